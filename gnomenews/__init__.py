@@ -13,35 +13,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from itertools import chain
-import logging
-import time
-logger = logging.getLogger(__name__)
-tabbing = 0
+from gnomenews.tracing import tracer
 
 
 def log(fn):
-    if logger.getEffectiveLevel() > logging.DEBUG:
-        return fn
+    """Trace calls of the function while tracing is on
 
-    def wrapped(*v, **k):
-        global tabbing
-        name = fn.__name__
-        module = fn.__module__
-        filename = fn.__code__.co_filename.split('/')[-1]
-        lineno = fn.__code__.co_firstlineno
-        params = ", ".join(map(repr, chain(v, k.values())))
-
-        tabbing += 1
-        start = time.time()
-        retval = fn(*v, **k)
-        elapsed = time.time() - start
-        tabbing -= 1
-        elapsed_time = ''
-        if elapsed > 0.5:
-            elapsed_time = ', took %02f' % elapsed
-        logger.debug("%s:%s\t%s%s.%s(%s), returned %s%s",
-                     filename, lineno, '|' * tabbing, module, name, params, retval, elapsed_time)
-
-        return retval
-    return wrapped
+    See gnomenews.tracing. The function is returned as it is, the arguments
+    and the return value aren't recorded, only the timing.
+    """
+    tracer.register(fn)
+    return fn
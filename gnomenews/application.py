@@ -18,12 +18,13 @@ from gi.repository import Gtk, GLib, Gio, Gdk
 from gettext import gettext as _
 
 from gnomenews import log
+from gnomenews import opml
+from gnomenews import startup
+from gnomenews.tracing import tracer, enable_from_environment
+from gnomenews.cache import ThumbnailCache
 from gnomenews.window import Window
-
-import os
-import os.path
-
-CACHE_PATH = "~/.cache/gnome-news"
+import logging
+logger = logging.getLogger(__name__)
 
 
 class Application(Gtk.Application):
@@ -35,7 +36,23 @@ class Application(Gtk.Application):
         GLib.set_application_name(_("News"))
         GLib.set_prgname('gnome-news')
         self.settings = Gio.Settings.new('org.gnome.News')
+        enable_from_environment()
+
+        self._window = None
+
+    @log
+    def create_cache(self):
+        self.thumbnail_cache = ThumbnailCache.get_default()
+        self.thumbnail_cache.max_size = self.settings.get_uint('thumbnail-cache-size') * 1024 * 1024
+        self.thumbnail_cache.max_age = self.settings.get_uint('thumbnail-cache-age') * 24 * 60 * 60
+        GLib.idle_add(self.thumbnail_cache.prune, priority=GLib.PRIORITY_LOW)
 
+    @log
+    def do_startup(self):
+        Gtk.Application.do_startup(self)
+        startup.mark('application-startup')
+
+        # Only the primary instance needs the style and the cache
         cssProviderFile = Gio.File.new_for_uri('resource:///org/gnome/News/application.css')
         cssProvider = Gtk.CssProvider()
         cssProvider.load_from_file(cssProviderFile)
@@ -44,19 +61,87 @@ class Application(Gtk.Application):
         styleContext.add_provider_for_screen(screen, cssProvider,
                                              Gtk.STYLE_PROVIDER_PRIORITY_USER)
 
-        self._window = None
-
         self.create_cache()
 
+        for name, callback in (('import-opml', self.import_opml),
+                               ('export-opml', self.export_opml),
+                               ('quit', self.quit)):
+            action = Gio.SimpleAction.new(name, None)
+            action.connect('activate', callback)
+            self.add_action(action)
+        # Toggled with `gapplication action org.gnome.News trace`, the trace
+        # is written when it is switched off
+        action = Gio.SimpleAction.new_stateful('trace', None, GLib.Variant('b', tracer.enabled))
+        action.connect('change-state', self._on_trace_changed)
+        self.add_action(action)
+
+        # Enabled by the window once the store is ready
+        for name in ('import-opml', 'export-opml'):
+            self.lookup_action(name).set_enabled(False)
+
+        menu = Gio.Menu()
+        section = Gio.Menu()
+        section.append(_("Import Subscriptions…"), 'app.import-opml')
+        section.append(_("Export Subscriptions…"), 'app.export-opml')
+        menu.append_section(None, section)
+        section = Gio.Menu()
+        section.append(_("Quit"), 'app.quit')
+        menu.append_section(None, section)
+        self.set_app_menu(menu)
+
     @log
-    def create_cache(self):
-        cache_full_path = os.path.expanduser(CACHE_PATH)
-        if not os.path.isdir(cache_full_path):
-            os.mkdir(cache_full_path)
+    def _choose_opml_file(self, title, action, accept_label):
+        dialog = Gtk.FileChooserDialog(title, self._window, action,
+                                       (_("_Cancel"), Gtk.ResponseType.CANCEL,
+                                        accept_label, Gtk.ResponseType.ACCEPT))
+        opml_filter = Gtk.FileFilter()
+        opml_filter.set_name(_("OPML files"))
+        opml_filter.add_pattern('*.opml')
+        opml_filter.add_pattern('*.xml')
+        dialog.add_filter(opml_filter)
+        if action == Gtk.FileChooserAction.SAVE:
+            dialog.set_do_overwrite_confirmation(True)
+            dialog.set_current_name('subscriptions.opml')
+
+        path = None
+        if dialog.run() == Gtk.ResponseType.ACCEPT:
+            path = dialog.get_filename()
+        dialog.destroy()
+        return path
 
     @log
-    def do_startup(self):
-        Gtk.Application.do_startup(self)
+    def import_opml(self, action=None, param=None):
+        path = self._choose_opml_file(_("Import Subscriptions"),
+                                      Gtk.FileChooserAction.OPEN, _("_Import"))
+        if path:
+            opml.import_opml(self._window.tracker, path)
+
+    @log
+    def export_opml(self, action=None, param=None):
+        path = self._choose_opml_file(_("Export Subscriptions"),
+                                      Gtk.FileChooserAction.SAVE, _("_Export"))
+        if path:
+            try:
+                opml.export_opml(self._window.tracker, path)
+            except OSError as e:
+                logger.error("Could not export subscriptions: %s", str(e))
+
+    def _on_trace_changed(self, action, state):
+        action.set_state(state)
+        if state.get_boolean():
+            tracer.enable()
+        else:
+            tracer.disable()
+
+    @log
+    def do_shutdown(self):
+        if self._window:
+            self._window.save_snapshot()
+        if self._window and self._window.tracker:
+            self._window.tracker.flush_writes()
+        self.thumbnail_cache.flush()
+        tracer.disable()
+        Gtk.Application.do_shutdown(self)
 
     @log
     def quit(self, action=None, param=None):
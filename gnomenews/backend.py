@@ -0,0 +1,193 @@
+# Copyright (C) 2015 Vadim Rutkovsky <vrutkovs@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import GObject, Gio, GLib
+
+import re
+
+from gnomenews import log
+import logging
+logger = logging.getLogger(__name__)
+
+# Listings only carry the beginning of the post body for previews, the full
+# HTML is fetched by get_post_content() when the post is opened
+SNIPPET_LENGTH = 1000
+
+
+class StorageBackend(GObject.GObject):
+    """Where channels and posts are stored
+
+    Posts are dicts with id, url, title, fullname (author), date
+    (GLib.DateTime), snippet (beginning of the HTML content), is_read,
+    channel (URL of the channel) and, where known, starred. Channels are
+    dicts with id, url, title and, from get_channels(), update_interval
+    (minutes).
+
+    Getters run synchronously and return the result unless a callback is
+    given, which then receives the result from the main loop. Changes of the
+    store, whoever made them, are reported by the signals.
+    """
+
+    __gsignals__ = {
+        'post-added': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+        'post-changed': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+        'post-removed': (GObject.SignalFlags.RUN_LAST, None, (str,)),
+        'channel-added': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+        'channel-changed': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+        'channel-removed': (GObject.SignalFlags.RUN_LAST, None, (str,)),
+    }
+
+    # Whether posts are fetched by someone else, otherwise the application
+    # fetches channels itself and stores posts with add_posts()
+    fetches_feeds = False
+
+    def __init__(self):
+        GObject.GObject.__init__(self)
+
+    def get_post_sorted_by_date(self, amount, unread=False, read_only=False, starred=False,
+                                after=None, callback=None):
+        """Get posts, newest first, continuing after the (date, url) key"""
+        raise NotImplementedError
+
+    def get_info_for_entry(self, url, callback=None):
+        """Get title and author of the post"""
+        raise NotImplementedError
+
+    def get_post_content(self, url, callback=None):
+        """Get the full HTML content of the post"""
+        raise NotImplementedError
+
+    def get_posts_for_channel(self, url, amount, after=None, callback=None):
+        """Get posts of the channel, newest first"""
+        raise NotImplementedError
+
+    def get_posts_for_channels(self, urls, amount, callback=None):
+        """Get a dict mapping each channel URL to its newest posts"""
+        raise NotImplementedError
+
+    def get_channels(self, url=None, callback=None):
+        """Get all channels, or the one with the given URL"""
+        raise NotImplementedError
+
+    def iter_channels(self):
+        """Iterate over all channels without collecting them in a list"""
+        raise NotImplementedError
+
+    def get_text_matches(self, text, amount, channel=None, callback=None,
+                         cancellable=None, progress=None, within=None):
+        """Get posts matching the text, best matches first
+
+        All words have to match, the last one as prefix. Posts may be passed
+        to progress in chunks before callback gets all of them. within
+        limits the search to the posts with the given IDs.
+        """
+        raise NotImplementedError
+
+    def add_channel(self, url, update_interval=30):
+        raise NotImplementedError
+
+    def add_channels(self, urls, update_interval=30, callback=None):
+        """Add several channels, callback is called once they are stored"""
+        raise NotImplementedError
+
+    def remove_channel(self, url):
+        raise NotImplementedError
+
+    def set_update_interval(self, url, update_interval):
+        """Set how often the channel is fetched, in minutes"""
+        raise NotImplementedError
+
+    @log
+    def mark_post_as_read(self, caller, url, data=None):
+        """Handler of FeedView::post-read"""
+        self.set_post_read(url, True)
+
+    def set_post_read(self, url, read=True):
+        raise NotImplementedError
+
+    def set_post_starred(self, url, starred=True):
+        raise NotImplementedError
+
+    def mark_channel_as_read(self, url):
+        raise NotImplementedError
+
+    def mark_all_as_read(self, before=None):
+        raise NotImplementedError
+
+    def flush_writes(self, wait=True):
+        """Write changes which are still queued"""
+        pass
+
+
+def search_terms(text):
+    """Split search text into words, dropping query syntax characters"""
+    return re.findall(r'\w+', text)
+
+
+def match_query(terms):
+    """Get the SQLite FTS5 query matching all terms, the last as prefix
+
+    Terms are quoted, so FTS5 query syntax is not exposed.
+    """
+    return ' '.join('"%s"' % term for term in terms) + '*'
+
+
+@log
+def get_storage_backend_async(callback, name=None):
+    """Create the storage backend without blocking the main loop
+
+    The connection to Tracker is set up asynchronously. The local store is
+    opened from an idle callback, so the window is drawn first either way.
+
+    Args:
+        callback (callable): receives the backend.
+        name (Optional[str]): 'tracker' or 'sqlite', the 'storage-backend'
+                              setting is used if not given.
+    """
+    settings = Gio.Settings.new('org.gnome.News')
+    if name is None:
+        name = settings.get_string('storage-backend')
+
+    if name == 'tracker':
+        try:
+            from gnomenews.tracker import Tracker, Trackr
+        except (ImportError, ValueError) as e:
+            logger.warning("Tracker is not available, using the local store: %s", str(e))
+        else:
+            def on_connection(source, result, data=None):
+                try:
+                    tracker = Tracker(connection=Trackr.SparqlConnection.get_finish(result))
+                except GLib.Error as e:
+                    logger.warning("Tracker is not available, using the local store: %s",
+                                   str(e))
+                    callback(_local_store())
+                    return
+                callback(_setup_tracker(tracker, settings))
+
+            Trackr.SparqlConnection.get_async(None, on_connection, None)
+            return
+
+    GLib.idle_add(lambda: callback(_local_store()), priority=GLib.PRIORITY_LOW)
+
+
+def _setup_tracker(tracker, settings):
+    if settings.get_boolean('local-search-index'):
+        tracker.enable_search_index()
+    return tracker
+
+
+def _local_store():
+    from gnomenews.localstore import SqliteStore
+    return SqliteStore()
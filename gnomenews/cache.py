@@ -0,0 +1,319 @@
+# Copyright (C) 2015 Vadim Rutkovsky <vrutkovs@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import GLib
+
+import hashlib
+import os
+import os.path
+import sqlite3
+import time
+
+from gnomenews import log
+import logging
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = "~/.cache/gnome-news"
+INDEX_FILENAME = "thumbnails.db"
+
+# Default budget of the thumbnail cache
+MAX_CACHE_SIZE = 100 * 1024 * 1024
+MAX_CACHE_AGE = 30 * 24 * 60 * 60
+# A cache over budget is pruned down to this fraction of it, so that not
+# every following thumbnail triggers another pruning
+PRUNE_LOW_WATER = 0.9
+# Access times are written back to the index at most this often, in seconds
+INDEX_FLUSH_INTERVAL = 30
+# Thumbnails of the old flat layout deleted per idle iteration
+FLAT_LAYOUT_BATCH_SIZE = 100
+
+
+class ThumbnailCache:
+    """Thumbnail files on disk together with an index describing them
+
+    The index keeps size, last access time, URL and channel of the post and
+    a hash of the content the thumbnail was drawn from for every file. It is
+    loaded once at startup, so looking up a thumbnail only checks that its
+    file still exists.
+
+    Files are named after a hash of the post URL and its content hash, and
+    spread over two levels of directories (ab/cd/abcd...png) to keep
+    directories small. A thumbnail whose content hash doesn't match the
+    current content of the post is stale and gets replaced.
+    """
+
+    _default = None
+
+    @classmethod
+    def get_default(cls):
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    @log
+    def __init__(self, path=CACHE_PATH, max_size=MAX_CACHE_SIZE, max_age=MAX_CACHE_AGE):
+        """
+        Args:
+            path (Optional[str]): cache directory.
+            max_size (Optional[int]): size budget in bytes.
+            max_age (Optional[int]): thumbnails not used for longer than this
+                                     many seconds are removed.
+        """
+        self.path = os.path.expanduser(path)
+        self.max_size = max_size
+        self.max_age = max_age
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        self._db = sqlite3.connect(os.path.join(self.path, INDEX_FILENAME))
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                file TEXT PRIMARY KEY,
+                size INTEGER,
+                last_access INTEGER,
+                url TEXT,
+                channel TEXT,
+                content_hash TEXT)""")
+
+        # File name relative to the cache directory -> dict with the index columns
+        self._entries = {}
+        # Post URL -> file name
+        self._files = {}
+        self.total_size = 0
+        for row in self._db.execute("""
+                SELECT file, size, last_access, url, channel, content_hash
+                FROM thumbnails"""):
+            self._entries[row[0]] = {
+                'size': row[1], 'last_access': row[2], 'url': row[3],
+                'channel': row[4], 'content_hash': row[5],
+            }
+            if row[3]:
+                self._files[row[3]] = row[0]
+            self.total_size += row[1]
+
+        # Files whose access time changed since the index was last written
+        self._dirty = set()
+        self._flush_id = None
+
+        # Thumbnails of the flat layout left to delete, listed in the idle
+        self._flat_files = None
+        GLib.idle_add(self._remove_flat_layout, priority=GLib.PRIORITY_LOW)
+
+    @log
+    def _remove_flat_layout(self):
+        """Delete thumbnails of the old flat layout, a batch per idle iteration
+
+        They were named after the post URL only, so the content they were
+        drawn from is unknown and they can't be told from stale ones.
+        """
+        if self._flat_files is None:
+            self._flat_files = [filename for filename in os.listdir(self.path)
+                                if filename.endswith('.png')]
+            if self._flat_files:
+                logger.info("Removing %d thumbnails of the old cache layout",
+                            len(self._flat_files))
+
+        batch = self._flat_files[:FLAT_LAYOUT_BATCH_SIZE]
+        del self._flat_files[:FLAT_LAYOUT_BATCH_SIZE]
+        # Files written before the index existed aren't in it
+        for filename in batch:
+            try:
+                os.remove(os.path.join(self.path, filename))
+            except OSError:
+                pass
+        return bool(self._flat_files)
+
+    @staticmethod
+    def _shard(key):
+        return os.path.join(key[0:2], key[2:4], '%s.png' % key)
+
+    def _ensure_directory(self, filename):
+        directory = os.path.dirname(os.path.join(self.path, filename))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @classmethod
+    def _filename(cls, url, content_hash):
+        key = hashlib.md5(('%s\0%s' % (url, content_hash)).encode()).hexdigest()
+        return cls._shard(key)
+
+    @staticmethod
+    def content_hash(*parts):
+        """Hash of the data a thumbnail is drawn from"""
+        return hashlib.md5('\0'.join(part or '' for part in parts).encode()).hexdigest()
+
+    @log
+    def path_for(self, url, content_hash):
+        """Where to store a thumbnail of the post drawn from the given content"""
+        filename = self._filename(url, content_hash)
+        self._ensure_directory(filename)
+        return os.path.join(self.path, filename)
+
+    @log
+    def lookup(self, url, content_hash):
+        """Get the path of the cached thumbnail of the post
+
+        Args:
+            url (str): URL of the post.
+            content_hash (str): hash of the current content of the post.
+
+        Returns:
+            path of the thumbnail or None if it is not cached or stale
+        """
+        filename = self._files.get(url)
+        entry = self._entries.get(filename)
+        if entry is None:
+            return None
+
+        # Thumbnails without a content hash may have been drawn from other
+        # content or by another renderer
+        if entry['content_hash'] != content_hash:
+            self._remove_files([filename])
+            return None
+
+        path = os.path.join(self.path, filename)
+        if not os.path.isfile(path):
+            logger.debug("Thumbnail of %s is gone from the cache", url)
+            self._remove_files([filename])
+            return None
+
+        entry['last_access'] = int(time.time())
+        entry['url'] = url
+        self._files[url] = filename
+        self._dirty.add(filename)
+        if not self._flush_id:
+            self._flush_id = GLib.timeout_add_seconds(INDEX_FLUSH_INTERVAL, self._on_flush_timeout)
+        return path
+
+    @log
+    def add(self, url, content_hash, channel=None):
+        """Register a thumbnail written to path_for(url, content_hash)"""
+        filename = self._filename(url, content_hash)
+        try:
+            size = os.path.getsize(os.path.join(self.path, filename))
+        except OSError as e:
+            logger.error("Could not add thumbnail of %s to the cache: %s", url, str(e))
+            return
+
+        # Drop the thumbnail drawn from the previous content
+        previous = self._files.get(url)
+        if previous and previous != filename:
+            self._remove_files([previous])
+
+        self._set_entry(filename, size, int(time.time()), url, channel, content_hash)
+        self._db.commit()
+        if self.total_size > self.max_size:
+            self.prune()
+
+    def _set_entry(self, filename, size, last_access, url, channel, content_hash):
+        old = self._entries.get(filename)
+        if old:
+            self.total_size -= old['size']
+        self._entries[filename] = {
+            'size': size, 'last_access': last_access, 'url': url,
+            'channel': channel, 'content_hash': content_hash,
+        }
+        if url:
+            self._files[url] = filename
+        self.total_size += size
+        self._db.execute("""
+            INSERT OR REPLACE INTO thumbnails
+            (file, size, last_access, url, channel, content_hash)
+            VALUES (?, ?, ?, ?, ?, ?)""", (filename, size, last_access, url, channel, content_hash))
+
+    @log
+    def _remove_files(self, filenames):
+        for filename in filenames:
+            entry = self._entries.pop(filename, None)
+            if entry is None:
+                continue
+            if self._files.get(entry['url']) == filename:
+                del self._files[entry['url']]
+            self.total_size -= entry['size']
+            self._dirty.discard(filename)
+            try:
+                os.remove(os.path.join(self.path, filename))
+            except OSError:
+                pass
+        self._db.executemany("DELETE FROM thumbnails WHERE file = ?",
+                             [(filename,) for filename in filenames])
+        self._db.commit()
+
+    @log
+    def remove(self, url):
+        """Drop the thumbnail of the post"""
+        filename = self._files.get(url)
+        if filename:
+            self._remove_files([filename])
+
+    @log
+    def remove_channel(self, channel):
+        """Drop thumbnails of all posts of the channel"""
+        self._remove_files([filename for filename, entry in self._entries.items()
+                            if entry['channel'] == channel])
+
+    @log
+    def on_post_removed(self, tracker, url):
+        self.remove(url)
+
+    @log
+    def on_channel_removed(self, tracker, url):
+        self.remove_channel(url)
+
+    @log
+    def prune(self):
+        """Enforce the age and size budget, least recently used files go first
+
+        A cache over budget is pruned to PRUNE_LOW_WATER of it.
+        """
+        too_old = int(time.time()) - self.max_age
+        by_access = sorted(self._entries.items(), key=lambda item: item[1]['last_access'])
+
+        target = self.max_size
+        if self.total_size > self.max_size:
+            target = int(self.max_size * PRUNE_LOW_WATER)
+
+        evicted = []
+        size = self.total_size
+        for filename, entry in by_access:
+            if entry['last_access'] >= too_old and size <= target:
+                break
+            evicted.append(filename)
+            size -= entry['size']
+
+        if evicted:
+            logger.debug("Evicting %d thumbnails from the cache", len(evicted))
+            self._remove_files(evicted)
+        return False
+
+    def _on_flush_timeout(self):
+        self._flush_id = None
+        self.flush()
+        return False
+
+    @log
+    def flush(self):
+        """Write pending access times to the index"""
+        if self._flush_id:
+            GLib.source_remove(self._flush_id)
+            self._flush_id = None
+
+        self._db.executemany(
+            "UPDATE thumbnails SET last_access = ?, url = ?, content_hash = ? WHERE file = ?",
+            [(self._entries[filename]['last_access'], self._entries[filename]['url'],
+              self._entries[filename]['content_hash'], filename)
+             for filename in self._dirty])
+        self._db.commit()
+        self._dirty.clear()
@@ -0,0 +1,353 @@
+# Copyright (C) 2015 Vadim Rutkovsky <vrutkovs@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import GLib, GObject, Soup
+
+from collections import deque
+import time
+
+from gnomenews import log
+from gnomenews.itemindex import ItemIndex
+from gnomenews.parser import FeedParser, FeedParseError
+from gnomenews.scheduler import poll_delay, DEFAULT_POLL_INTERVAL
+import logging
+logger = logging.getLogger(__name__)
+
+# Channels fetched at the same time, in total and from one host
+FETCH_POOL_SIZE = 6
+FETCH_POOL_SIZE_PER_HOST = 2
+# Seconds between the starts of two requests to the same host
+HOST_REQUEST_INTERVAL = 1
+# Seconds between checks which channels are due
+FETCH_CHECK_INTERVAL = 60
+# Network errors are retried this often, waiting RETRY_DELAY seconds,
+# doubled with every attempt
+FETCH_RETRIES = 2
+RETRY_DELAY = 10
+FETCH_TIMEOUT = 30
+# New posts are written to the store in batches of this size while the
+# response is still arriving
+STORE_BATCH_SIZE = 50
+
+
+class Fetcher(GObject.GObject):
+    """Fetches channels of the store over HTTP and stores their posts
+
+    Used with storage backends which don't get their posts from elsewhere.
+    One Soup.Session keeps connections to the hosts alive between requests.
+    At most FETCH_POOL_SIZE requests run at once, FETCH_POOL_SIZE_PER_HOST
+    of them to the same host, and requests to a host are spaced by
+    HOST_REQUEST_INTERVAL seconds. ETag and Last-Modified of the previous
+    response are sent along, so unchanged channels are answered with 304
+    Not Modified and not parsed again.
+
+    Responses are parsed as they arrive and not kept in memory. Posts which
+    are already stored unchanged are skipped with the help of an ItemIndex.
+    """
+
+    __gsignals__ = {
+        'channel-fetched': (GObject.SignalFlags.RUN_LAST, None, (str, int)),
+    }
+
+    @log
+    def __init__(self, store, pool_size=FETCH_POOL_SIZE,
+                 pool_size_per_host=FETCH_POOL_SIZE_PER_HOST, session=None, index=None):
+        """
+        Args:
+            store (StorageBackend): where channels are read from and posts
+                                    are written to.
+            pool_size (Optional[int]): requests running at the same time.
+            pool_size_per_host (Optional[int]): requests running at the
+                                                same time to one host.
+            session (Optional[Soup.Session]): session to use.
+            index (Optional[ItemIndex]): index of the stored posts.
+        """
+        GObject.GObject.__init__(self)
+        self.store = store
+        self.pool_size = pool_size
+        self.pool_size_per_host = pool_size_per_host
+        self.session = session or Soup.Session(
+            max_conns=pool_size, max_conns_per_host=pool_size_per_host,
+            timeout=FETCH_TIMEOUT, user_agent='gnome-news ')
+        self.index = index or ItemIndex()
+
+        # URLs of the channels waiting for a free slot, in order
+        self._queue = deque()
+        # URL -> number of the attempt, for queued and running fetches
+        self._attempts = {}
+        # Soup.Message -> URL of the channel
+        self._running = {}
+        # Soup.Message -> FeedParser of the response, None if it failed
+        self._parsers = {}
+        # Soup.Message -> new posts not stored yet
+        self._pending_posts = {}
+        # Host -> number of running requests and time the last one started
+        self._host_running = {}
+        self._host_last_start = {}
+        self._wakeup_id = None
+        self._check_id = None
+
+        self.fetched = 0
+        self.not_modified = 0
+        self.failed = 0
+        self.new_posts = 0
+
+        self.store.connect('channel-added', self._on_channel_added)
+        self.store.connect('channel-removed', self._on_channel_removed)
+
+    @log
+    def start(self):
+        """Fetch channels which are due now and check again periodically"""
+        self.check_due_channels()
+        if not self._check_id:
+            self._check_id = GLib.timeout_add_seconds(FETCH_CHECK_INTERVAL,
+                                                      self.check_due_channels)
+
+    @log
+    def stop(self):
+        if self._check_id:
+            GLib.source_remove(self._check_id)
+            self._check_id = None
+        if self._wakeup_id:
+            GLib.source_remove(self._wakeup_id)
+            self._wakeup_id = None
+        self._queue.clear()
+        self._attempts.clear()
+        self.session.abort()
+
+    @log
+    def check_due_channels(self):
+        now = time.time()
+        for state in self.store.get_fetch_states():
+            next_fetch = state['next_fetch']
+            if next_fetch is None and state['last_fetched']:
+                next_fetch = state['last_fetched'] + \
+                    (state['update_interval'] or DEFAULT_POLL_INTERVAL) * 60
+            if not next_fetch or now >= next_fetch:
+                self.fetch(state['url'])
+        return True
+
+    @log
+    def fetch(self, url):
+        """Queue fetching of the channel unless it is queued already"""
+        if url in self._attempts:
+            return
+        self._attempts[url] = 0
+        self._queue.append(url)
+        self._process_queue()
+
+    def _on_channel_added(self, store, channel):
+        self.fetch(channel['url'])
+
+    def _on_channel_removed(self, store, url):
+        self.index.remove_channel(url)
+        self._attempts.pop(url, None)
+        if url in self._queue:
+            self._queue.remove(url)
+        for message, channel in list(self._running.items()):
+            if channel == url:
+                self.session.cancel_message(message, Soup.Status.CANCELLED)
+
+    @staticmethod
+    def _host(url):
+        uri = Soup.URI.new(url)
+        return uri.get_host() if uri else None
+
+    @log
+    def _process_queue(self):
+        """Start queued requests as far as the limits allow"""
+        if self._wakeup_id:
+            GLib.source_remove(self._wakeup_id)
+            self._wakeup_id = None
+
+        now = time.monotonic()
+        wait = None
+        for url in list(self._queue):
+            if len(self._running) >= self.pool_size:
+                return
+
+            host = self._host(url)
+            if self._host_running.get(host, 0) >= self.pool_size_per_host:
+                continue
+            delay = self._host_last_start.get(host, 0) + HOST_REQUEST_INTERVAL - now
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+
+            self._queue.remove(url)
+            self._start_request(url, host)
+
+        if wait is not None:
+            self._wakeup_id = GLib.timeout_add(int(wait * 1000) + 1, self._on_wakeup)
+
+    def _on_wakeup(self):
+        self._wakeup_id = None
+        self._process_queue()
+        return False
+
+    @log
+    def _start_request(self, url, host):
+        message = Soup.Message.new('GET', url)
+        if message is None:
+            logger.warning("Invalid channel URL %s", url)
+            self._attempts.pop(url, None)
+            return
+
+        state = self.store.get_fetch_state(url)
+        if state and state['etag']:
+            message.request_headers.append('If-None-Match', state['etag'])
+        if state and state['last_modified']:
+            message.request_headers.append('If-Modified-Since', state['last_modified'])
+
+        message.response_body.set_accumulate(False)
+        message.connect('got-chunk', self._on_got_chunk, url)
+        self._parsers[message] = FeedParser()
+        self._pending_posts[message] = []
+
+        self._running[message] = url
+        self._host_running[host] = self._host_running.get(host, 0) + 1
+        self._host_last_start[host] = time.monotonic()
+        self.session.queue_message(message, self._on_response, (url, host))
+
+    @log
+    def _on_response(self, session, message, data):
+        url, host = data
+        del self._running[message]
+        self._host_running[host] -= 1
+        status = message.status_code
+        parser = self._parsers.pop(message)
+        pending = self._pending_posts.pop(message)
+
+        if status == Soup.Status.CANCELLED:
+            self._attempts.pop(url, None)
+        elif status == Soup.Status.NOT_MODIFIED:
+            self.not_modified += 1
+            self._done(url, status, message)
+        elif 200 <= status < 300:
+            stored = self._finish_feed(url, parser, pending)
+            self._done(url, status, message, failed=not stored)
+        elif status < 100 or status >= 500:
+            # Connection problems and server errors are worth another try
+            self._retry(url, status)
+        else:
+            logger.warning("Could not fetch %s: %d %s", url, status, message.reason_phrase)
+            self.failed += 1
+            self._done(url, status, None, failed=True)
+
+        self._process_queue()
+
+    def _on_got_chunk(self, message, chunk, url):
+        if not 200 <= message.status_code < 300:
+            return
+        parser = self._parsers.get(message)
+        if parser is None:
+            return
+
+        try:
+            posts = parser.feed(chunk.get_as_bytes().get_data())
+        except FeedParseError as e:
+            logger.warning("Could not parse %s: %s", url, str(e))
+            self._parsers[message] = None
+            return
+
+        pending = self._pending_posts[message]
+        pending += self.index.filter_new(url, posts)
+        if len(pending) >= STORE_BATCH_SIZE:
+            self._store_posts(url, pending)
+
+    @log
+    def _finish_feed(self, url, parser, pending):
+        """Store the rest of the posts of a complete response
+
+        Args:
+            url (str): URL of the channel.
+            parser (FeedParser): parser of the response, None if it failed.
+            pending (list): new posts not stored yet.
+
+        Returns:
+            True if the whole response was parsed
+        """
+        ok = parser is not None
+        if ok:
+            try:
+                pending += self.index.filter_new(url, parser.close())
+            except FeedParseError as e:
+                logger.warning("Could not parse %s: %s", url, str(e))
+                ok = False
+            if parser.title:
+                self.store.update_channel(url, parser.title)
+
+        # Posts parsed before an error are fine to keep
+        self._store_posts(url, pending)
+        if ok:
+            self.fetched += 1
+        else:
+            self.failed += 1
+        return ok
+
+    @log
+    def _store_posts(self, url, posts):
+        """Write new posts to the store and forget them"""
+        if not posts:
+            return
+        self.store.add_posts(url, posts)
+        self.index.add(url, posts)
+        self.new_posts += len(posts)
+        del posts[:]
+
+    @log
+    def _retry(self, url, status):
+        attempt = self._attempts.get(url)
+        if attempt is None:
+            return
+        if attempt >= FETCH_RETRIES:
+            logger.warning("Giving up fetching %s: %d", url, status)
+            self.failed += 1
+            self._done(url, status, None, failed=True)
+            return
+
+        self._attempts[url] = attempt + 1
+
+        def requeue():
+            if url in self._attempts:
+                self._queue.append(url)
+                self._process_queue()
+            return False
+
+        GLib.timeout_add_seconds(RETRY_DELAY * 2 ** attempt, requeue)
+
+    @log
+    def _done(self, url, status, message, failed=False):
+        """Remember the validators and schedule the next fetch of the channel
+
+        Failing channels are fetched less and less often.
+        """
+        self._attempts.pop(url, None)
+        state = self.store.get_fetch_state(url) or {}
+        etag = last_modified = None
+        if message is not None and not failed:
+            etag = message.response_headers.get_one('ETag')
+            last_modified = message.response_headers.get_one('Last-Modified')
+        if status == Soup.Status.NOT_MODIFIED or message is None or failed:
+            # Keep the validators of the last full response
+            etag = etag or state.get('etag')
+            last_modified = last_modified or state.get('last_modified')
+
+        failures = (state.get('failures') or 0) + 1 if failed else 0
+        interval = state.get('update_interval') or DEFAULT_POLL_INTERVAL
+        now = int(time.time())
+        self.store.set_fetch_state(url, etag, last_modified, now, failures,
+                                   now + int(poll_delay(interval, failures)))
+        self.emit('channel-fetched', url, status)
@@ -0,0 +1,168 @@
+# Copyright (C) 2015 Vadim Rutkovsky <vrutkovs@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import GLib
+
+import hashlib
+import os
+import os.path
+import sqlite3
+
+from gnomenews import log
+from gnomenews.cache import CACHE_PATH
+from gnomenews.localstore import STORE_PATH
+import logging
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "items.db"
+# Number of keys read from disk into the Bloom filter per main loop iteration
+BLOOM_FILL_BATCH_SIZE = 5000
+
+# 2^20 bits and 7 hashes keep false positives below 1% for ~100000 items
+BLOOM_BITS = 1 << 20
+BLOOM_HASHES = 7
+
+
+class BloomFilter:
+    """Set of strings which answers "no" exactly and "yes" with few errors"""
+
+    def __init__(self, bits=BLOOM_BITS, hashes=BLOOM_HASHES):
+        self.bits = bits
+        self.hashes = hashes
+        self._array = bytearray(bits // 8)
+
+    def _positions(self, key):
+        digest = hashlib.sha256(key.encode()).digest()
+        for i in range(self.hashes):
+            yield int.from_bytes(digest[i * 4:i * 4 + 4], 'little') % self.bits
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self._array[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+
+class ItemIndex:
+    """Posts already stored, to skip them when their channel is fetched again
+
+    The index maps channel and GUID of every stored post to a hash of its
+    content and is kept on disk next to the local store, as it describes
+    what the store holds and mustn't go away with the cache. A Bloom filter
+    of the keys is filled in the background after startup, so posts never
+    seen before, the common case for new items, are recognized without
+    touching the disk. Only posts which may be known are looked up to
+    compare the content hash, and all of them until the filter is filled.
+    """
+
+    @log
+    def __init__(self, path=STORE_PATH):
+        """
+        Args:
+            path (Optional[str]): directory of the index.
+        """
+        self.path = os.path.expanduser(path)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        filename = os.path.join(self.path, INDEX_FILENAME)
+        old_filename = os.path.join(os.path.expanduser(CACHE_PATH), INDEX_FILENAME)
+        if not os.path.exists(filename) and os.path.exists(old_filename):
+            # Kept in the cache directory before
+            try:
+                os.replace(old_filename, filename)
+            except OSError as e:
+                logger.warning("Could not move the item index: %s", str(e))
+
+        self._db = sqlite3.connect(filename)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                channel TEXT,
+                guid TEXT,
+                hash TEXT,
+                PRIMARY KEY (channel, guid))""")
+        self._bloom = BloomFilter()
+        # Whether all keys on disk are in the Bloom filter
+        self._filled = False
+        self._fill_rowid = 0
+        GLib.idle_add(self._fill_bloom, priority=GLib.PRIORITY_LOW)
+
+    @log
+    def _fill_bloom(self):
+        """Add the next batch of keys on disk to the Bloom filter"""
+        rows = self._db.execute(
+            "SELECT rowid, channel, guid FROM items WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (self._fill_rowid, BLOOM_FILL_BATCH_SIZE)).fetchall()
+        for rowid, channel, guid in rows:
+            self._bloom.add(self._key(channel, guid))
+        if rows:
+            self._fill_rowid = rows[-1][0]
+        if len(rows) == BLOOM_FILL_BATCH_SIZE:
+            return True
+
+        # Items stored meanwhile were added by add()
+        self._filled = True
+        return False
+
+    @staticmethod
+    def _key(channel, guid):
+        return '%s\0%s' % (channel, guid)
+
+    @staticmethod
+    def item_hash(item):
+        return hashlib.md5('\0'.join(
+            str(item.get(field) or '') for field in ('url', 'title', 'author', 'date', 'content')
+        ).encode()).hexdigest()
+
+    @log
+    def filter_new(self, channel, items):
+        """Get the items which are not stored yet or have changed
+
+        Args:
+            channel (str): URL of the channel.
+            items (list): posts as returned by the parser.
+        """
+        ret = []
+        for item in items:
+            item_hash = self.item_hash(item)
+            if not self._filled or self._key(channel, item['guid']) in self._bloom:
+                row = self._db.execute("SELECT hash FROM items WHERE channel = ? AND guid = ?",
+                                       (channel, item['guid'])).fetchone()
+                if row and row[0] == item_hash:
+                    continue
+            item['hash'] = item_hash
+            ret.append(item)
+        return ret
+
+    @log
+    def add(self, channel, items):
+        """Remember items returned by filter_new() once they are stored"""
+        for item in items:
+            self._bloom.add(self._key(channel, item['guid']))
+        self._db.executemany("INSERT OR REPLACE INTO items (channel, guid, hash) VALUES (?, ?, ?)",
+                             [(channel, item['guid'], item['hash']) for item in items])
+        self._db.commit()
+
+    @log
+    def remove_channel(self, channel):
+        """Forget the items of the channel
+
+        They stay in the Bloom filter until the next start, which only costs
+        a disk lookup if the channel is added again.
+        """
+        self._db.execute("DELETE FROM items WHERE channel = ?", (channel,))
+        self._db.commit()
@@ -0,0 +1,468 @@
+# Copyright (C) 2015 Vadim Rutkovsky <vrutkovs@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import GLib
+
+import os
+import os.path
+import sqlite3
+
+from gnomenews import log
+from gnomenews.backend import StorageBackend, SNIPPET_LENGTH, match_query, search_terms
+import logging
+logger = logging.getLogger(__name__)
+
+STORE_PATH = "~/.local/share/gnome-news"
+STORE_FILENAME = "news.db"
+
+POST_SUMMARY_COLUMNS = """
+          p.id AS id,
+          p.url AS url,
+          p.title AS title,
+          p.author AS fullname,
+          p.date AS date,
+          substr(p.content, 1, %d) AS snippet,
+          p.is_read AS is_read,
+          p.starred AS starred,
+          c.url AS channel""" % SNIPPET_LENGTH
+POST_TABLES = "posts p JOIN channels c ON c.id = p.channel"
+
+SCHEMA = """
+        CREATE TABLE IF NOT EXISTS channels (
+            id INTEGER PRIMARY KEY,
+            url TEXT UNIQUE NOT NULL,
+            title TEXT,
+            update_interval INTEGER);
+        CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER PRIMARY KEY,
+            url TEXT UNIQUE NOT NULL,
+            channel INTEGER NOT NULL,
+            title TEXT,
+            author TEXT,
+            date INTEGER,
+            content TEXT,
+            is_read INTEGER NOT NULL DEFAULT 0,
+            starred INTEGER NOT NULL DEFAULT 0);
+        CREATE INDEX IF NOT EXISTS posts_by_date ON posts (date DESC, url DESC);
+        CREATE INDEX IF NOT EXISTS posts_by_channel ON posts (channel, date DESC, url DESC);
+        CREATE INDEX IF NOT EXISTS posts_by_read ON posts (is_read, date DESC, url DESC);
+        CREATE INDEX IF NOT EXISTS posts_by_starred ON posts (starred, date DESC, url DESC);
+        CREATE TABLE IF NOT EXISTS fetch_state (
+            channel INTEGER PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            last_fetched INTEGER,
+            failures INTEGER NOT NULL DEFAULT 0,
+            next_fetch INTEGER);
+"""
+
+FTS_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+            title, author, content, content='posts', content_rowid='id');
+        CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+            INSERT INTO posts_fts (rowid, title, author, content)
+            VALUES (new.id, new.title, new.author, new.content);
+        END;
+        CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, title, author, content)
+            VALUES ('delete', old.id, old.title, old.author, old.content);
+        END;
+        CREATE TRIGGER IF NOT EXISTS posts_fts_update
+        AFTER UPDATE OF title, author, content ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, title, author, content)
+            VALUES ('delete', old.id, old.title, old.author, old.content);
+            INSERT INTO posts_fts (rowid, title, author, content)
+            VALUES (new.id, new.title, new.author, new.content);
+        END;
+"""
+
+
+class SqliteStore(StorageBackend):
+    """Storage backend keeping channels and posts in a local SQLite database
+
+    Queries don't leave the process, so there is no need for the result
+    caching and change batching the Tracker backend does. Results for
+    callbacks and change signals are still delivered from the main loop, as
+    with Tracker, so callers never get them while still making the call.
+    """
+
+    @log
+    def __init__(self, path=STORE_PATH):
+        """
+        Args:
+            path (Optional[str]): directory of the database.
+        """
+        StorageBackend.__init__(self)
+        self.path = os.path.expanduser(path)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        self._db = sqlite3.connect(os.path.join(self.path, STORE_FILENAME))
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.executescript(SCHEMA)
+        self._add_missing_columns('fetch_state', (
+            ('failures', 'INTEGER NOT NULL DEFAULT 0'),
+            ('next_fetch', 'INTEGER')))
+        try:
+            self._db.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError as e:
+            logger.warning("SQLite has no FTS5, search will be slow: %s", str(e))
+            self.has_fts = False
+        self._db.commit()
+
+        # IDs of posts whose change is yet to be announced
+        self._changed_posts = set()
+        self._changes_id = None
+
+    def _add_missing_columns(self, table, columns):
+        """Upgrade a table created by an older version"""
+        existing = set(row['name'] for row in self._db.execute("PRAGMA table_info(%s)" % table))
+        for name, definition in columns:
+            if name not in existing:
+                self._db.execute("ALTER TABLE %s ADD COLUMN %s %s" % (table, name, definition))
+
+    @staticmethod
+    def _post(row):
+        post = dict(row)
+        if post['date'] is not None:
+            post['date'] = GLib.DateTime.new_from_unix_local(post['date'])
+        post['is_read'] = bool(post['is_read'])
+        post['starred'] = bool(post['starred'])
+        return post
+
+    @staticmethod
+    def _reply(ret, callback, cancellable=None):
+        if callback:
+            def deliver():
+                if not (cancellable and cancellable.is_cancelled()):
+                    callback(ret)
+                return False
+            GLib.idle_add(deliver)
+            return
+        return ret
+
+    def _emit_later(self, signals):
+        """Emit the (name, argument) pairs from the main loop, in order"""
+        def emit():
+            for name, arg in signals:
+                self.emit(name, arg)
+            return False
+        if signals:
+            GLib.idle_add(emit)
+
+    def _select_posts(self, where, params, order="ORDER BY p.date DESC, p.url DESC", limit=None,
+                      tables=POST_TABLES):
+        query = "SELECT %s FROM %s WHERE %s %s" % (POST_SUMMARY_COLUMNS, tables, where or "1",
+                                                   order)
+        if limit is not None:
+            query += " LIMIT ?"
+            params = list(params) + [limit]
+        return [self._post(row) for row in self._db.execute(query, params)]
+
+    @staticmethod
+    def _keyset_filter(after):
+        """SQL condition and parameters selecting posts ordered after the given one"""
+        if after is None:
+            return None, []
+        date = after[0].to_unix() if after[0] is not None else None
+        return "(p.date < ? OR (p.date = ? AND p.url < ?))", [date, date, after[1]]
+
+    @log
+    def get_post_sorted_by_date(self, amount, unread=False, read_only=False, starred=False,
+                                after=None, callback=None):
+        conditions = []
+        params = []
+        if unread:
+            conditions.append("p.is_read = 0")
+        if read_only:
+            conditions.append("p.is_read = 1")
+        if starred:
+            conditions.append("p.starred = 1")
+        keyset, keyset_params = self._keyset_filter(after)
+        if keyset:
+            conditions.append(keyset)
+            params += keyset_params
+
+        ret = self._select_posts(" AND ".join(conditions), params, limit=amount)
+        return self._reply(ret, callback)
+
+    @log
+    def get_info_for_entry(self, url, callback=None):
+        row = self._db.execute("SELECT title, author AS fullname FROM posts WHERE url = ?",
+                               (url,)).fetchone()
+        if row is None:
+            raise Exception("No post with url %s" % url)
+        return self._reply(dict(row), callback)
+
+    @log
+    def get_post_content(self, url, callback=None):
+        row = self._db.execute("SELECT content FROM posts WHERE url = ?", (url,)).fetchone()
+        return self._reply(row['content'] if row else None, callback)
+
+    @log
+    def get_posts_for_channel(self, url, amount, after=None, callback=None):
+        where = "c.url = ?"
+        params = [url]
+        keyset, keyset_params = self._keyset_filter(after)
+        if keyset:
+            where += " AND " + keyset
+            params += keyset_params
+
+        ret = self._select_posts(where, params, limit=amount)
+        return self._reply(ret, callback)
+
+    @log
+    def get_posts_for_channels(self, urls, amount, callback=None):
+        # Each lookup is a walk of the posts_by_channel index, cheaper than
+        # any combined query
+        ret = dict((url, self.get_posts_for_channel(url, amount)) for url in urls)
+        return self._reply(ret, callback)
+
+    @log
+    def get_channels(self, url=None, callback=None):
+        if url is None:
+            rows = self._db.execute(
+                "SELECT id, url, title, update_interval FROM channels ORDER BY title")
+        else:
+            rows = self._db.execute(
+                "SELECT id, url, title, update_interval FROM channels WHERE url = ?", (url,))
+        return self._reply([dict(row) for row in rows], callback)
+
+    def iter_channels(self):
+        for row in self._db.execute("SELECT url, title FROM channels ORDER BY title"):
+            yield dict(row)
+
+    @log
+    def get_text_matches(self, text, amount, channel=None, callback=None,
+                         cancellable=None, progress=None, within=None):
+        terms = search_terms(text)
+        if not terms or (within is not None and not within):
+            return self._reply([], callback)
+
+        if self.has_fts:
+            tables = ("posts_fts JOIN posts p ON p.id = posts_fts.rowid "
+                      "JOIN channels c ON c.id = p.channel")
+            where = "posts_fts MATCH ?"
+            params = [match_query(terms)]
+            order = "ORDER BY posts_fts.rank"
+        else:
+            tables = POST_TABLES
+            where = " AND ".join(["(p.title LIKE ? ESCAPE '\\' OR p.content LIKE ? ESCAPE '\\')"]
+                                 * len(terms))
+            params = []
+            for term in terms:
+                term = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                params += ['%%%s%%' % term] * 2
+            order = "ORDER BY p.date DESC, p.url DESC"
+
+        if channel:
+            where += " AND c.url = ?"
+            params.append(channel)
+        if within is not None:
+            where += " AND p.id IN (%s)" % ', '.join(str(int(i)) for i in within)
+
+        ret = self._select_posts(where, params, order, limit=amount, tables=tables)
+        if cancellable and cancellable.is_cancelled():
+            return
+        return self._reply(ret, callback, cancellable)
+
+    @log
+    def add_channel(self, url, update_interval=30):
+        self.add_channels([url], update_interval)
+
+    @log
+    def add_channels(self, urls, update_interval=30, callback=None):
+        added = []
+        for url in urls:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO channels (url, update_interval) VALUES (?, ?)",
+                (url, update_interval))
+            if cursor.rowcount:
+                added.append({'id': cursor.lastrowid, 'url': url, 'title': None})
+        self._db.commit()
+        self._emit_later([('channel-added', channel) for channel in added])
+        if callback:
+            GLib.idle_add(callback)
+
+    @log
+    def update_channel(self, url, title):
+        """Set the title of the channel"""
+        self._db.execute("UPDATE channels SET title = ? WHERE url = ?", (title, url))
+        self._db.commit()
+        self._emit_later([('channel-changed', channel) for channel in self.get_channels(url)])
+
+    @log
+    def add_posts(self, channel, posts):
+        """Store new and updated posts of the channel
+
+        Args:
+            channel (str): URL of the channel.
+            posts (list): dicts with url, title, author, date (seconds since
+                          the epoch) and content of the posts. Read and
+                          starred states of known posts are kept.
+        """
+        row = self._db.execute("SELECT id FROM channels WHERE url = ?", (channel,)).fetchone()
+        if row is None:
+            return
+
+        added = []
+        for post in posts:
+            cursor = self._db.execute("""
+                UPDATE posts SET title = ?, author = ?, date = ?, content = ?
+                WHERE url = ? AND (title IS NOT ? OR author IS NOT ? OR date IS NOT ? OR
+                                   content IS NOT ?)""",
+                (post['title'], post['author'], post['date'], post['content'], post['url'],
+                 post['title'], post['author'], post['date'], post['content']))
+            if cursor.rowcount:
+                self._changed_posts.update(
+                    r['id'] for r in self._db.execute("SELECT id FROM posts WHERE url = ?",
+                                                      (post['url'],)))
+                continue
+            cursor = self._db.execute("""
+                INSERT OR IGNORE INTO posts (url, channel, title, author, date, content)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (post['url'], row['id'], post['title'], post['author'], post['date'],
+                 post['content']))
+            if cursor.rowcount:
+                added.append(cursor.lastrowid)
+        self._db.commit()
+
+        if added:
+            self._emit_later([('post-added', post) for post in self._posts_by_id(added)])
+        self._queue_changes(())
+
+    @log
+    def get_fetch_states(self):
+        """Get what the fetcher knows about each channel
+
+        Returns:
+            list of dicts with url, update_interval (minutes), etag,
+            last_modified, last_fetched and next_fetch (seconds since the
+            epoch) and failures (failed fetches in a row) of the channels
+        """
+        return [dict(row) for row in self._db.execute("""
+            SELECT c.url AS url, c.update_interval AS update_interval,
+                   f.etag AS etag, f.last_modified AS last_modified,
+                   f.last_fetched AS last_fetched, f.failures AS failures,
+                   f.next_fetch AS next_fetch
+            FROM channels c LEFT JOIN fetch_state f ON f.channel = c.id
+            ORDER BY f.next_fetch""")]
+
+    @log
+    def get_fetch_state(self, url):
+        """Get what the fetcher knows about the channel, or None"""
+        row = self._db.execute("""
+            SELECT c.update_interval AS update_interval,
+                   f.etag AS etag, f.last_modified AS last_modified,
+                   f.last_fetched AS last_fetched, f.failures AS failures,
+                   f.next_fetch AS next_fetch
+            FROM channels c LEFT JOIN fetch_state f ON f.channel = c.id
+            WHERE c.url = ?""", (url,)).fetchone()
+        return dict(row) if row else None
+
+    @log
+    def set_fetch_state(self, url, etag, last_modified, last_fetched, failures=0, next_fetch=None):
+        """Remember the outcome of the last fetch of the channel"""
+        self._db.execute("""
+            INSERT OR REPLACE INTO fetch_state
+            (channel, etag, last_modified, last_fetched, failures, next_fetch)
+            SELECT id, ?, ?, ?, ?, ? FROM channels WHERE url = ?""",
+                         (etag, last_modified, last_fetched, failures, next_fetch, url))
+        self._db.commit()
+
+    @log
+    def set_update_interval(self, url, update_interval):
+        self._db.execute("UPDATE channels SET update_interval = ? WHERE url = ?",
+                         (update_interval, url))
+        self._db.commit()
+
+    @log
+    def remove_channel(self, url):
+        row = self._db.execute("SELECT id FROM channels WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return
+
+        removed = [r['url'] for r in self._db.execute("SELECT url FROM posts WHERE channel = ?",
+                                                       (row['id'],))]
+        self._db.execute("DELETE FROM posts WHERE channel = ?", (row['id'],))
+        self._db.execute("DELETE FROM fetch_state WHERE channel = ?", (row['id'],))
+        self._db.execute("DELETE FROM channels WHERE id = ?", (row['id'],))
+        self._db.commit()
+
+        self._emit_later([('post-removed', post_url) for post_url in removed] +
+                         [('channel-removed', url)])
+
+    def _update_posts(self, column, value, where, params):
+        """Set a flag of the selected posts and announce the changed ones
+
+        Args:
+            column (str): 'is_read' or 'starred'.
+            value (bool): new value.
+            where (str): condition selecting the posts.
+            params (iterable): parameters of the condition.
+        """
+        ids = [row['id'] for row in self._db.execute(
+            "SELECT p.id FROM %s WHERE %s AND p.%s != ?" % (POST_TABLES, where, column),
+            list(params) + [int(value)])]
+        if not ids:
+            return
+        self._db.execute("UPDATE posts SET %s = ? WHERE id IN (%s)"
+                         % (column, ', '.join(str(i) for i in ids)), (int(value),))
+        self._db.commit()
+        self._queue_changes(ids)
+
+    @log
+    def set_post_read(self, url, read=True):
+        self._update_posts('is_read', read, "p.url = ?", (url,))
+
+    @log
+    def set_post_starred(self, url, starred=True):
+        self._update_posts('starred', starred, "p.url = ?", (url,))
+
+    @log
+    def mark_channel_as_read(self, url):
+        self._update_posts('is_read', True, "c.url = ?", (url,))
+
+    @log
+    def mark_all_as_read(self, before=None):
+        if before is None:
+            self._update_posts('is_read', True, "1", ())
+        else:
+            self._update_posts('is_read', True, "p.date < ?", (before.to_unix(),))
+
+    def _posts_by_id(self, ids):
+        ids = list(ids)
+        return self._select_posts("p.id IN (%s)" % ', '.join(str(i) for i in ids), [])
+
+    def _queue_changes(self, ids):
+        self._changed_posts.update(ids)
+        if self._changed_posts and not self._changes_id:
+            self._changes_id = GLib.idle_add(self._emit_changes)
+
+    @log
+    def _emit_changes(self):
+        self._changes_id = None
+        ids = self._changed_posts
+        self._changed_posts = set()
+        for post in self._posts_by_id(ids):
+            self.emit('post-changed', post)
+        return False
+
+    @log
+    def flush_writes(self, wait=True):
+        self._db.commit()
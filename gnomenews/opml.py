@@ -0,0 +1,161 @@
+# Copyright (C) 2015 Vadim Rutkovsky <vrutkovs@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import GLib
+
+from xml.etree import ElementTree
+from xml.sax.saxutils import quoteattr
+import time
+
+from gnomenews import log
+import logging
+logger = logging.getLogger(__name__)
+
+# Number of channels inserted by a single update
+OPML_BATCH_SIZE = 100
+
+
+class OpmlImporter:
+    """Subscribes to the channels listed in an OPML file
+
+    The file is parsed incrementally, one batch of channels per main loop
+    iteration, so large files neither block the UI nor end up in memory as
+    a whole. Each batch is written asynchronously and the next one is read
+    once it is stored. Channels which are already subscribed are skipped.
+    """
+
+    @log
+    def __init__(self, tracker, path, callback=None):
+        """
+        Args:
+            tracker (Tracker): where to add the channels.
+            path (str): OPML file.
+            callback (Optional[callable]): called with the number of added
+                                           channels when the import finished.
+        """
+        self.tracker = tracker
+        self.path = path
+        self.callback = callback
+        self.added = 0
+        self.skipped = 0
+        self._outlines = None
+        self._known = None
+        self._started = None
+
+    @log
+    def start(self):
+        self._started = time.monotonic()
+        # A single lookup of all channels, answered from the query cache if
+        # possible, instead of one per imported URL
+        self.tracker.get_channels(callback=self._on_channels)
+
+    @log
+    def _on_channels(self, channels):
+        self._known = set(channel['url'] for channel in channels)
+        self._outlines = self._iter_feed_urls()
+        GLib.idle_add(self._import_batch, priority=GLib.PRIORITY_LOW)
+
+    def _iter_feed_urls(self):
+        for event, elem in ElementTree.iterparse(self.path):
+            if elem.tag == 'outline':
+                url = elem.get('xmlUrl')
+                if url:
+                    yield url.strip()
+                # Nested outlines are reported before their parent
+                elem.clear()
+
+    @log
+    def _import_batch(self):
+        batch = []
+        try:
+            for url in self._outlines:
+                if url in self._known:
+                    self.skipped += 1
+                    continue
+                self._known.add(url)
+                batch.append(url)
+                if len(batch) == OPML_BATCH_SIZE:
+                    break
+        except (ElementTree.ParseError, OSError) as e:
+            logger.error("Could not read %s: %s", self.path, str(e))
+            self._outlines = iter(())
+
+        self.added += len(batch)
+        if len(batch) == OPML_BATCH_SIZE:
+            self.tracker.add_channels(batch, callback=self._on_batch_added)
+        else:
+            self.tracker.add_channels(batch, callback=self._finish)
+        return False
+
+    def _on_batch_added(self):
+        GLib.idle_add(self._import_batch, priority=GLib.PRIORITY_LOW)
+
+    @log
+    def _finish(self):
+        elapsed = time.monotonic() - self._started
+        logger.info("Imported %d channels from %s in %.2f s (%.0f channels/s), "
+                    "%d already subscribed", self.added, self.path, elapsed,
+                    self.added / elapsed if elapsed else 0, self.skipped)
+        if self.callback:
+            self.callback(self.added)
+
+
+@log
+def import_opml(tracker, path, callback=None):
+    """Subscribe to the channels listed in an OPML file
+
+    Args:
+        tracker (Tracker): where to add the channels.
+        path (str): OPML file.
+        callback (Optional[callable]): called with the number of added
+                                       channels when the import finished.
+    """
+    importer = OpmlImporter(tracker, path, callback)
+    importer.start()
+    return importer
+
+
+@log
+def export_opml(tracker, path):
+    """Write all channels to an OPML file
+
+    Channels are written out as they are read from Tracker.
+
+    Args:
+        tracker (Tracker): where to read the channels from.
+        path (str): OPML file.
+
+    Returns:
+        number of exported channels
+    """
+    started = time.monotonic()
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<opml version="2.0">\n'
+                '  <head>\n'
+                '    <title>GNOME News subscriptions</title>\n'
+                '  </head>\n'
+                '  <body>\n')
+        for channel in tracker.iter_channels():
+            title = quoteattr(channel['title'] or channel['url'])
+            f.write('    <outline type="rss" text=%s title=%s xmlUrl=%s/>\n' % (
+                title, title, quoteattr(channel['url'])))
+            count += 1
+        f.write('  </body>\n'
+                '</opml>\n')
+
+    logger.info("Exported %d channels to %s in %.2f s", count, path, time.monotonic() - started)
+    return count
@@ -0,0 +1,180 @@
+# Copyright (C) 2015 Vadim Rutkovsky <vrutkovs@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from xml.etree import ElementTree
+from email.utils import parsedate_to_datetime
+import datetime
+
+import logging
+logger = logging.getLogger(__name__)
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+RSS1 = '{http://purl.org/rss/1.0/}'
+DC = '{http://purl.org/dc/elements/1.1/}'
+CONTENT = '{http://purl.org/rss/1.0/modules/content/}'
+RDF = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}'
+
+
+class FeedParseError(Exception):
+    pass
+
+
+def parse_date(text):
+    """Convert an RFC 822 or ISO 8601 date to seconds since the epoch"""
+    if not text:
+        return None
+    text = text.strip()
+    try:
+        date = parsedate_to_datetime(text)
+    except (TypeError, ValueError, IndexError):
+        try:
+            date = datetime.datetime.fromisoformat(text.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return int(date.timestamp())
+
+
+def _text(elem, *tags):
+    """Text of the first of the child elements which is present"""
+    for tag in tags:
+        child = elem.find(tag)
+        if child is not None and child.text:
+            return child.text.strip()
+    return None
+
+
+def _atom_link(elem):
+    for link in elem.findall(ATOM + 'link'):
+        if link.get('rel', 'alternate') == 'alternate':
+            return link.get('href')
+    return None
+
+
+def _rss_entry(item):
+    return {
+        'url': _text(item, 'link', RSS1 + 'link', 'guid'),
+        'guid': _text(item, 'guid') or item.get(RDF + 'about'),
+        'title': _text(item, 'title', RSS1 + 'title'),
+        'author': _text(item, 'author', DC + 'creator'),
+        'date': parse_date(_text(item, 'pubDate', DC + 'date')),
+        'content': _text(item, CONTENT + 'encoded', 'description', RSS1 + 'description'),
+    }
+
+
+def _atom_entry(entry):
+    author = entry.find(ATOM + 'author')
+    return {
+        'url': _atom_link(entry) or _text(entry, ATOM + 'id'),
+        'guid': _text(entry, ATOM + 'id'),
+        'title': _text(entry, ATOM + 'title'),
+        'author': _text(author, ATOM + 'name') if author is not None else None,
+        'date': parse_date(_text(entry, ATOM + 'updated', ATOM + 'published')),
+        'content': _text(entry, ATOM + 'content', ATOM + 'summary'),
+    }
+
+
+ITEM_PARSERS = {
+    'item': _rss_entry,
+    RSS1 + 'item': _rss_entry,
+    ATOM + 'entry': _atom_entry,
+}
+CHANNEL_TITLES = ('title', RSS1 + 'title', ATOM + 'title')
+
+
+class FeedParser:
+    """Incremental parser of RSS 1.0, RSS 2.0 and Atom documents
+
+    The document is passed in chunks as it arrives and posts are returned
+    as soon as their element is complete. Elements of parsed posts are
+    dropped right away, so memory use doesn't grow with the document.
+    """
+
+    def __init__(self):
+        self._parser = ElementTree.XMLPullParser(events=('start', 'end'))
+        # Elements enclosing the current one
+        self._stack = []
+        self.title = None
+
+    def feed(self, data):
+        """Parse the next chunk of the document
+
+        Args:
+            data (bytes): the chunk.
+
+        Returns:
+            list of posts completed by the chunk, dicts with url, guid,
+            title, author, date and content
+
+        Raises:
+            FeedParseError: if the document is no feed.
+        """
+        try:
+            self._parser.feed(data)
+        except ElementTree.ParseError as e:
+            raise FeedParseError(str(e))
+        return self._read_events()
+
+    def close(self):
+        """Finish parsing and get the last posts"""
+        try:
+            self._parser.close()
+        except ElementTree.ParseError as e:
+            raise FeedParseError(str(e))
+        return self._read_events()
+
+    def _read_events(self):
+        entries = []
+        for event, elem in self._parser.read_events():
+            if event == 'start':
+                if not self._stack and elem.tag not in ('rss', ATOM + 'feed') \
+                   and not elem.tag.endswith('RDF'):
+                    raise FeedParseError("Unknown feed format %s" % elem.tag)
+                self._stack.append(elem)
+                continue
+
+            self._stack.pop()
+            parse_item = ITEM_PARSERS.get(elem.tag)
+            if parse_item:
+                entry = parse_item(elem)
+                if entry['url']:
+                    entry['guid'] = entry['guid'] or entry['url']
+                    entries.append(entry)
+                if self._stack:
+                    self._stack[-1].remove(elem)
+            elif elem.tag in CHANNEL_TITLES and self.title is None and \
+                    not any(e.tag in ITEM_PARSERS for e in self._stack):
+                self.title = elem.text.strip() if elem.text else None
+        return entries
+
+
+def parse_feed(data):
+    """Parse a complete RSS 1.0, RSS 2.0 or Atom document
+
+    Args:
+        data (bytes): the document.
+
+    Returns:
+        (title of the channel, list of dicts with url, guid, title, author,
+        date and content of the posts)
+
+    Raises:
+        FeedParseError: if the document is no feed.
+    """
+    parser = FeedParser()
+    entries = parser.feed(data)
+    entries += parser.close()
+    return parser.title, entries
@@ -13,19 +13,27 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from gi.repository import WebKit2, GObject, GLib
+from gi.repository import WebKit2, GObject, GLib, Gio, Pango, PangoCairo
 
-import hashlib
-import os.path
+from html.parser import HTMLParser
+import cairo
+import heapq
+import itertools
 
 from gnomenews import log
+from gnomenews.cache import ThumbnailCache
 import logging
 logger = logging.getLogger(__name__)
 
 THUMBNAIL_WIDTH = 256
 THUMBNAIL_HEIGHT = 256
-# FIXME: Remove duplication with application.py
-CACHE_PATH = "~/.cache/gnome-news"
+# Number of WebViews used to render thumbnails at the same time
+RENDERER_POOL_SIZE = 2
+# Layout of the thumbnail card drawn by the native renderer
+CARD_WIDTH = 250
+CARD_MARGIN = 3
+# Longest text drawn on a card, the rest wouldn't fit anyway
+CARD_TEXT_LENGTH = 600
 
 
 class Post(GObject.GObject):
@@ -36,60 +44,331 @@ class Post(GObject.GObject):
 
     @log
     def __init__(self, cursor):
+        """
+        Args:
+            cursor (dict): post as returned by Tracker.
+        """
         GObject.GObject.__init__(self)
 
         self.cursor = cursor
+        self.priority = GLib.PRIORITY_DEFAULT
+        self.cancelled = False
+        self.thumbnail = None
+        self._lookup_id = None
+        self._renderer = None
 
         self.title = cursor['title']
-        self.content = cursor['content']
+        self.content = cursor['snippet']
         self.author = cursor['fullname']
 
-        # Check cache first
-        hashed_url = hashlib.md5(cursor['url'].encode()).hexdigest()
-        self.cached_thumbnail_path = os.path.join(os.path.expanduser(CACHE_PATH), '%s.png' % hashed_url)
+        self.cache = ThumbnailCache.get_default()
 
-        GLib.idle_add(self.try_to_load_image_from_cache)
+    @log
+    def load_thumbnail(self, priority=GLib.PRIORITY_DEFAULT):
+        """Get the thumbnail from the cache or render it
+
+        info-updated is emitted once the thumbnail is available. Calling this
+        again while the thumbnail is being rendered only updates the priority.
+
+        Args:
+            priority (Optional[int]): priority of the thumbnail rendering,
+                                      lower values are rendered first.
+        """
+        self.priority = priority
+        self.cancelled = False
+        if self.thumbnail or self._lookup_id:
+            return
+
+        if self._renderer:
+            self._renderer.request(self)
+        else:
+            self._lookup_id = GLib.idle_add(self.try_to_load_image_from_cache)
 
     @log
     def try_to_load_image_from_cache(self):
-        if os.path.isfile(self.cached_thumbnail_path):
-            self.thumbnail = self.cached_thumbnail_path
+        self._lookup_id = None
+        if self.cancelled:
+            return False
+
+        # Thumbnails are invalidated when the post or the way it is drawn changes
+        renderer = get_thumbnail_renderer()
+        self.content_hash = ThumbnailCache.content_hash(
+            renderer.NAME, str(renderer.VERSION), self.title, self.author, self.content)
+
+        cached = self.cache.lookup(self.cursor['url'], self.content_hash)
+        if cached:
+            self.thumbnail = cached
             self.emit('info-updated', self)
         else:
-            self.webview = WebKit2.WebView(sensitive=False)
-            self.webview.connect('load-changed', self._draw_thumbnail)
-            self._generate_thumbnail()
+            self.cached_thumbnail_path = self.cache.path_for(self.cursor['url'], self.content_hash)
+            self.request_thumbnail(renderer)
+        return False
+
+    @log
+    def request_thumbnail(self, renderer):
+        self._renderer = renderer
+        renderer.request(self)
 
     @log
-    def _generate_thumbnail(self):
-        self.webview.load_html("""
+    def cancel(self):
+        """Don't render the thumbnail if it wasn't rendered yet"""
+        self.cancelled = True
+        if self._lookup_id:
+            GLib.source_remove(self._lookup_id)
+            self._lookup_id = None
+        if self._renderer:
+            self._renderer.cancel(self)
+
+    @log
+    def get_thumbnail_html(self):
+        return """
             <div style="width: 250px">
                 <h3 style="margin-bottom: 2px">%s</h3>
                 <small style="color: #333">%s</small>
                 <small style="color: #9F9F9F">%s</small>
-            </div>""" % (self.title, self.author, self.content))
+            </div>""" % (self.title, self.author, self.content)
+
+    @log
+    def thumbnail_rendered(self):
+        self.cache.add(self.cursor['url'], self.content_hash, self.cursor.get('channel'))
+        self.thumbnail = self.cached_thumbnail_path
+        if not self.cancelled:
+            self.emit('info-updated', self)
+
+
+class ThumbnailRenderer:
+    """Base class of thumbnail renderers
+
+    Requests are queued by priority, subclasses implement _process_queue()
+    and take posts off the queue with _pop_request(). Cancelled requests are
+    dropped from the queue; renderings already in progress are finished to
+    fill the cache.
+    """
+
+    NAME = None
+    # Bump when the look of the thumbnails changes to redraw cached ones
+    VERSION = 1
+
+    def __init__(self):
+        # Heap of [priority, sequence number, post]; cancelled entries have
+        # their post set to None
+        self._queue = []
+        # Post -> its entry in the queue
+        self._entries = {}
+        self._counter = itertools.count()
+
+    @log
+    def request(self, post):
+        """Queue rendering of the post thumbnail, or update its priority"""
+        self.cancel(post)
+        entry = [post.priority, next(self._counter), post]
+        self._entries[post] = entry
+        heapq.heappush(self._queue, entry)
+        self._process_queue()
+
+    @log
+    def cancel(self, post):
+        entry = self._entries.pop(post, None)
+        if entry:
+            entry[2] = None
+
+    @log
+    def _pop_request(self):
+        """Get the queued post with the highest priority, or None"""
+        while self._queue:
+            post = heapq.heappop(self._queue)[2]
+            if post is not None:
+                del self._entries[post]
+                return post
+        return None
+
+    def _process_queue(self):
+        raise NotImplementedError
+
+
+class WebKitThumbnailRenderer(ThumbnailRenderer):
+    """Renders post thumbnails as HTML with a small pool of reused WebViews
+
+    At most RENDERER_POOL_SIZE thumbnails are rendered at the same time.
+    """
+
+    NAME = 'webkit'
+
+    def __init__(self, pool_size=RENDERER_POOL_SIZE):
+        ThumbnailRenderer.__init__(self)
+        self.pool_size = pool_size
+        self._idle_webviews = []
+        # WebView -> Post being rendered
+        self._busy = {}
+
+    @log
+    def request(self, post):
+        if post not in self._busy.values():
+            ThumbnailRenderer.request(self, post)
+
+    @log
+    def _process_queue(self):
+        while self._idle_webviews or len(self._busy) < self.pool_size:
+            post = self._pop_request()
+            if post is None:
+                return
+
+            if self._idle_webviews:
+                webview = self._idle_webviews.pop()
+            else:
+                webview = WebKit2.WebView(sensitive=False)
+                webview.connect('load-changed', self._draw_thumbnail)
+
+            self._busy[webview] = post
+            webview.load_html(post.get_thumbnail_html())
 
     @log
     def _draw_thumbnail(self, webview, event):
         if event == WebKit2.LoadEvent.FINISHED:
-            self.webview.get_snapshot(WebKit2.SnapshotRegion.FULL_DOCUMENT,
-                                      WebKit2.SnapshotOptions.NONE,
-                                      None, self._save_thumbnail, None)
+            webview.get_snapshot(WebKit2.SnapshotRegion.FULL_DOCUMENT,
+                                 WebKit2.SnapshotOptions.NONE,
+                                 None, self._save_thumbnail, None)
 
     @log
     def _save_thumbnail(self, webview, res, data):
+        post = self._busy.pop(webview)
         try:
-            original_surface = self.webview.get_snapshot_finish(res)
+            original_surface = webview.get_snapshot_finish(res)
 
-            import cairo
             new_surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT)
             ctx = cairo.Context(new_surface)
             ctx.set_source_surface(original_surface, 0, 0)
             ctx.paint()
 
-            new_surface.write_to_png(self.cached_thumbnail_path)
+            new_surface.write_to_png(post.cached_thumbnail_path)
+            post.thumbnail_rendered()
+        except Exception as e:
+            logger.error("Could not draw thumbnail for %s: %s" % (post.title, str(e)))
+        finally:
+            self._idle_webviews.append(webview)
+            self._process_queue()
 
-            self.thumbnail = self.cached_thumbnail_path
-            self.emit('info-updated', self)
+
+class NativeThumbnailRenderer(ThumbnailRenderer):
+    """Draws post thumbnails with Pango directly on a cairo surface
+
+    One thumbnail is drawn per main loop iteration. Posts which can't be
+    drawn are handed over to the WebKit renderer.
+    """
+
+    NAME = 'native'
+
+    def __init__(self):
+        ThumbnailRenderer.__init__(self)
+        self._idle_id = None
+
+    @log
+    def _process_queue(self):
+        if not self._idle_id:
+            self._idle_id = GLib.idle_add(self._render_next, priority=GLib.PRIORITY_LOW)
+
+    @log
+    def _render_next(self):
+        post = self._pop_request()
+        if post is None:
+            self._idle_id = None
+            return False
+
+        try:
+            render_card(post.cached_thumbnail_path, post.title, post.author,
+                        strip_html(post.content))
+            post.thumbnail_rendered()
         except Exception as e:
-            logger.error("Could not draw thumbnail for %s: %s" % (self.title, str(e)))
+            logger.warning("Could not draw thumbnail for %s natively, using WebKit: %s",
+                           post.title, str(e))
+            post.request_thumbnail(get_thumbnail_renderer('webkit'))
+        return True
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.chunks = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self._skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style') and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.chunks.append(data)
+
+
+def strip_html(html):
+    """Get the text of an HTML fragment with whitespace collapsed"""
+    if not html:
+        return ''
+    # Snippets are cut at a fixed length, possibly inside a tag
+    start = html.rfind('<')
+    if start > html.rfind('>'):
+        html = html[:start]
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return ' '.join(''.join(parser.chunks).split())
+
+
+def render_card(path, title, author, text):
+    """Draw a thumbnail card and save it as PNG
+
+    Args:
+        path (str): where to save the thumbnail.
+        title (str): title of the post.
+        author (str): author of the post.
+        text (str): plain text of the post.
+    """
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT)
+    ctx = cairo.Context(surface)
+    ctx.set_source_rgb(1, 1, 1)
+    ctx.paint()
+
+    markup = '<b><big>%s</big></b>\n<small><span color="#333">%s</span> ' \
+             '<span color="#9F9F9F">%s</span></small>' % (
+                 GLib.markup_escape_text(title or ''),
+                 GLib.markup_escape_text(author or ''),
+                 GLib.markup_escape_text(text[:CARD_TEXT_LENGTH]))
+
+    layout = PangoCairo.create_layout(ctx)
+    layout.set_width(CARD_WIDTH * Pango.SCALE)
+    layout.set_wrap(Pango.WrapMode.WORD_CHAR)
+    layout.set_markup(markup, -1)
+
+    ctx.move_to(CARD_MARGIN, CARD_MARGIN)
+    PangoCairo.show_layout(ctx, layout)
+    surface.write_to_png(path)
+
+
+RENDERERS = {
+    NativeThumbnailRenderer.NAME: NativeThumbnailRenderer,
+    WebKitThumbnailRenderer.NAME: WebKitThumbnailRenderer,
+}
+_renderers = {}
+_settings = None
+
+
+def get_thumbnail_renderer(name=None):
+    """Get the shared thumbnail renderer
+
+    Args:
+        name (Optional[str]): 'native' or 'webkit', the 'thumbnail-renderer'
+                              setting is used if not given.
+    """
+    global _settings
+    if name is None:
+        if _settings is None:
+            _settings = Gio.Settings.new('org.gnome.News')
+        name = _settings.get_string('thumbnail-renderer')
+
+    if name not in _renderers:
+        _renderers[name] = RENDERERS.get(name, NativeThumbnailRenderer)()
+    return _renderers[name]
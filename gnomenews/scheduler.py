@@ -0,0 +1,155 @@
+# Copyright (C) 2015 Vadim Rutkovsky <vrutkovs@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import GLib
+
+import random
+import time
+
+from gnomenews import log
+import logging
+logger = logging.getLogger(__name__)
+
+# Bounds of the update interval of a channel, in minutes
+MIN_POLL_INTERVAL = 5
+MAX_POLL_INTERVAL = 24 * 60
+DEFAULT_POLL_INTERVAL = 30
+# Number of recent posts the posting rate of a channel is learned from
+RATE_HISTORY = 20
+# A channel is polled this many times per typical gap between its posts
+POLLS_PER_POST = 2
+# Intervals are randomly stretched or shrunk by up to this fraction, so
+# channels added together don't stay in step
+POLL_JITTER = 0.1
+# Intervals are only written when they change by more than this fraction.
+# Stored intervals carry jitter, so this must be larger than POLL_JITTER.
+CHANGE_THRESHOLD = 2 * POLL_JITTER
+# Failing channels wait twice as long after every failure, up to this many
+# times
+MAX_BACKOFF = 6
+# Seconds between updates of the intervals
+RESCHEDULE_INTERVAL = 6 * 60 * 60
+
+
+def estimate_interval(dates, now=None):
+    """Learn the update interval of a channel from the dates of its posts
+
+    The median gap between recent posts is robust against bursts and single
+    long breaks. A channel which has been silent for longer than that is
+    polled as if the silence was its typical gap.
+
+    Args:
+        dates (list): creation times of recent posts, seconds since the epoch.
+        now (Optional[float]): current time.
+
+    Returns:
+        update interval in minutes
+    """
+    dates = sorted((date for date in dates if date), reverse=True)
+    if len(dates) < 2:
+        return DEFAULT_POLL_INTERVAL
+
+    now = now or time.time()
+    gaps = sorted(newer - older for newer, older in zip(dates, dates[1:]))
+    gap = max(gaps[len(gaps) // 2], now - dates[0])
+    interval = gap / POLLS_PER_POST / 60
+    return int(min(max(interval, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL))
+
+
+def poll_delay(interval, failures=0):
+    """Seconds until the next poll of a channel
+
+    Args:
+        interval (int): update interval of the channel in minutes.
+        failures (Optional[int]): failed polls in a row.
+    """
+    minutes = min(interval * 2 ** min(failures, MAX_BACKOFF), MAX_POLL_INTERVAL)
+    return minutes * 60 * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+
+class PollScheduler:
+    """Adjusts the update intervals of channels to how often they post
+
+    Channels posting every few minutes are polled every few minutes, weekly
+    ones about twice a day. The intervals are written to the store, where
+    tracker-miner-rss or the in-app Fetcher pick them up.
+    """
+
+    @log
+    def __init__(self, store):
+        """
+        Args:
+            store (StorageBackend): store of the channels.
+        """
+        self.store = store
+        # Channel URL -> update interval stored, including jitter
+        self.intervals = {}
+        self._timeout_id = None
+
+        self.store.connect('channel-removed', self._on_channel_removed)
+
+    @log
+    def start(self):
+        GLib.idle_add(self.update_intervals, priority=GLib.PRIORITY_LOW)
+        if not self._timeout_id:
+            self._timeout_id = GLib.timeout_add_seconds(RESCHEDULE_INTERVAL,
+                                                        self._on_timeout)
+
+    @log
+    def stop(self):
+        if self._timeout_id:
+            GLib.source_remove(self._timeout_id)
+            self._timeout_id = None
+
+    @log
+    def update_intervals(self):
+        """Learn the posting rate of every channel and adjust its interval"""
+        self.store.get_channels(callback=self._on_channels)
+        return False
+
+    def _on_timeout(self):
+        self.update_intervals()
+        return True
+
+    def _on_channels(self, channels):
+        for channel in channels:
+            if channel.get('update_interval'):
+                self.intervals.setdefault(channel['url'], channel['update_interval'])
+        urls = [channel['url'] for channel in channels]
+        if urls:
+            self.store.get_posts_for_channels(urls, RATE_HISTORY, callback=self._on_history)
+
+    @log
+    def _on_history(self, posts_by_channel):
+        now = time.time()
+        changed = 0
+        for url, posts in posts_by_channel.items():
+            dates = [post['date'].to_unix() for post in posts if post['date']]
+            if not dates:
+                # Nothing learned yet, keep what the channel was added with
+                continue
+            interval = estimate_interval(dates, now)
+            # Small changes aren't worth a write
+            old = self.intervals.get(url)
+            if old and abs(interval - old) <= old * CHANGE_THRESHOLD:
+                continue
+            jittered = interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+            self.intervals[url] = max(int(jittered), MIN_POLL_INTERVAL)
+            self.store.set_update_interval(url, self.intervals[url])
+            changed += 1
+        logger.debug("Adjusted update intervals of %d channels", changed)
+
+    def _on_channel_removed(self, store, url):
+        self.intervals.pop(url, None)
@@ -0,0 +1,227 @@
+# Copyright (C) 2015 Vadim Rutkovsky <vrutkovs@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import GLib
+
+import os
+import os.path
+import sqlite3
+
+from gnomenews import log
+from gnomenews.backend import SNIPPET_LENGTH, match_query, search_terms
+from gnomenews.cache import CACHE_PATH
+from gnomenews.post import strip_html
+import logging
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "search.db"
+# Number of posts fetched from the store at once while building the index
+INDEX_BATCH_SIZE = 500
+# Changed posts are fetched and indexed after this many ms
+INDEX_UPDATE_DELAY = 1000
+# BM25 weights of title, author and text
+BM25_WEIGHTS = (10.0, 2.0, 1.0)
+
+
+class SearchIndex:
+    """Full text index of the posts of a store, kept on disk
+
+    Posts are indexed with title, author and the text of their HTML
+    content and ranked with BM25. On every start the index catches up in
+    the background with posts stored since the highest post ID indexed so
+    far and drops posts the store no longer has, as tracker-miner-rss keeps
+    working while the application is closed. Afterwards it follows the
+    post-added and post-changed signals of the store, which in turn passes
+    the IDs of all deleted posts to remove_posts(). Summary columns are kept
+    along with the text, so searches are answered without asking the store.
+    """
+
+    @log
+    def __init__(self, store, path=CACHE_PATH):
+        """
+        Args:
+            store (StorageBackend): store providing get_index_documents().
+            path (Optional[str]): cache directory.
+        """
+        self.store = store
+        self.path = os.path.expanduser(path)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        self._db = sqlite3.connect(os.path.join(self.path, INDEX_FILENAME))
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                id INTEGER PRIMARY KEY,
+                url TEXT UNIQUE,
+                title TEXT,
+                fullname TEXT,
+                date INTEGER,
+                snippet TEXT,
+                is_read INTEGER,
+                starred INTEGER,
+                channel TEXT);
+            CREATE INDEX IF NOT EXISTS docs_by_channel ON docs (channel);
+            CREATE VIRTUAL TABLE IF NOT EXISTS terms USING fts5(title, fullname, text);""")
+        self._db.commit()
+
+        # Whether the index caught up with the store, searches go to the
+        # store until then
+        self.ready = False
+        row = self._db.execute("SELECT MAX(id) FROM docs").fetchone()
+        self._last_id = row[0] or 0
+
+        # IDs of posts to fetch and index again
+        self._pending = set()
+        self._update_id = None
+
+        self.store.connect('post-added', self._on_post_changed)
+        self.store.connect('post-changed', self._on_post_changed)
+
+    @log
+    def start(self):
+        """Catch up with the store in the background"""
+        GLib.idle_add(self._build, priority=GLib.PRIORITY_LOW)
+
+    @log
+    def _build(self):
+        self.store.get_index_documents(after_id=self._last_id, amount=INDEX_BATCH_SIZE,
+                                       callback=self._on_build_batch)
+        return False
+
+    @log
+    def _on_build_batch(self, docs):
+        self._write(docs)
+        if docs:
+            self._last_id = max(self._last_id, max(doc['id'] for doc in docs))
+        if len(docs) == INDEX_BATCH_SIZE:
+            GLib.idle_add(self._build, priority=GLib.PRIORITY_LOW)
+            return
+
+        self.store.get_post_ids(callback=self._on_post_ids)
+
+    @log
+    def _on_post_ids(self, ids):
+        """Drop the posts removed from the store while nobody listened"""
+        stored = set(ids)
+        # Posts indexed after the IDs were read have higher IDs
+        newest = max(stored) if stored else self._last_id
+        gone = [(row[0],) for row in self._db.execute("SELECT id FROM docs WHERE id <= ?",
+                                                      (newest,))
+                if row[0] not in stored]
+        self._db.executemany("DELETE FROM terms WHERE rowid = ?", gone)
+        self._db.executemany("DELETE FROM docs WHERE id = ?", gone)
+        self._db.commit()
+
+        self.ready = True
+        logger.info("Search index of %d posts complete",
+                    self._db.execute("SELECT COUNT(*) FROM docs").fetchone()[0])
+
+    @log
+    def _write(self, docs):
+        """Add or replace posts in the index"""
+        ids = [(doc['id'],) for doc in docs]
+        self._db.executemany("DELETE FROM terms WHERE rowid = ?", ids)
+        self._db.executemany("DELETE FROM docs WHERE id = ?", ids)
+        self._db.executemany("""
+            INSERT OR REPLACE INTO docs
+            (id, url, title, fullname, date, snippet, is_read, starred, channel)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            [(doc['id'], doc['url'], doc['title'], doc['fullname'],
+              doc['date'].to_unix() if doc['date'] else None,
+              (doc['content'] or '')[:SNIPPET_LENGTH], int(bool(doc['is_read'])),
+              int(bool(doc.get('starred'))), doc['channel'])
+             for doc in docs])
+        self._db.executemany("INSERT INTO terms (rowid, title, fullname, text) VALUES (?, ?, ?, ?)",
+                             [(doc['id'], doc['title'], doc['fullname'], strip_html(doc['content']))
+                              for doc in docs])
+        self._db.commit()
+
+    def _on_post_changed(self, store, post):
+        self._pending.add(post['id'])
+        if not self._update_id:
+            self._update_id = GLib.timeout_add(INDEX_UPDATE_DELAY, self._update)
+
+    @log
+    def _update(self):
+        self._update_id = None
+        ids = list(self._pending)
+        self._pending.clear()
+        if ids:
+            self.store.get_index_documents(ids=ids, callback=self._write)
+        return False
+
+    @log
+    def remove_posts(self, ids):
+        """Drop posts deleted from the store
+
+        Args:
+            ids (iterable): IDs of the posts, including ones not indexed.
+        """
+        ids = [(post_id,) for post_id in ids]
+        if not ids:
+            return
+        self._pending.difference_update(post_id for post_id, in ids)
+        self._db.executemany("DELETE FROM terms WHERE rowid = ?", ids)
+        self._db.executemany("DELETE FROM docs WHERE id = ?", ids)
+        self._db.commit()
+
+    @log
+    def search(self, text, amount, channel=None, unread=None, within=None):
+        """Find posts containing all words of the text, the last as prefix
+
+        Args:
+            text (str): text to search for.
+            amount (int): number of posts to return.
+            channel (Optional[str]): URL of the channel to search in.
+            unread (Optional[bool]): only unread posts if True, only read
+                                     ones if False.
+            within (Optional[list]): IDs of the posts to search among.
+
+        Returns:
+            list of posts, best matches first
+        """
+        terms = search_terms(text)
+        if not terms or (within is not None and not within):
+            return []
+
+        query = """
+            SELECT d.id AS id, d.url AS url, d.title AS title, d.fullname AS fullname,
+                   d.date AS date, d.snippet AS snippet, d.is_read AS is_read,
+                   d.starred AS starred, d.channel AS channel
+            FROM terms JOIN docs d ON d.id = terms.rowid
+            WHERE terms MATCH ?"""
+        params = [match_query(terms)]
+        if channel:
+            query += " AND d.channel = ?"
+            params.append(channel)
+        if unread is not None:
+            query += " AND d.is_read = ?"
+            params.append(int(not unread))
+        if within is not None:
+            query += " AND d.id IN (%s)" % ', '.join(str(int(i)) for i in within)
+        query += " ORDER BY bm25(terms, %s, %s, %s) LIMIT ?" % BM25_WEIGHTS
+        params.append(amount)
+
+        ret = []
+        for row in self._db.execute(query, params):
+            post = dict(row)
+            if post['date'] is not None:
+                post['date'] = GLib.DateTime.new_from_unix_local(post['date'])
+            post['is_read'] = bool(post['is_read'])
+            post['starred'] = bool(post['starred'])
+            ret.append(post)
+        return ret
@@ -0,0 +1,100 @@
+# Copyright (C) 2015 Vadim Rutkovsky <vrutkovs@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import GLib
+
+import gzip
+import json
+import os
+import os.path
+
+from gnomenews import log
+from gnomenews.cache import CACHE_PATH, ThumbnailCache
+import logging
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILENAME = "new-view.json.gz"
+# Bumped when the stored fields change, older snapshots are ignored then
+SNAPSHOT_VERSION = 2
+# Post fields kept in the snapshot, besides the date
+SNAPSHOT_FIELDS = ('id', 'url', 'title', 'fullname', 'snippet', 'is_read', 'channel',
+                   'content_hash')
+
+
+@log
+def save_snapshot(posts, path=CACHE_PATH):
+    """Save the posts shown in the New view for the next start
+
+    Thumbnails are kept as the content hash they are cached under, so the
+    snapshot doesn't depend on where the cache puts its files.
+
+    Args:
+        posts (list): posts with the content hash of their thumbnail, if it
+                      was loaded, under the 'content_hash' key.
+        path (Optional[str]): cache directory.
+    """
+    path = os.path.expanduser(path)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    rows = []
+    for post in posts:
+        row = {field: post.get(field) for field in SNAPSHOT_FIELDS}
+        row['date'] = post['date'].to_unix() if post['date'] else None
+        rows.append(row)
+
+    filename = os.path.join(path, SNAPSHOT_FILENAME)
+    try:
+        # Written next to the old one and renamed, so a crash can't leave
+        # half a snapshot behind
+        with gzip.open(filename + '.tmp', 'wt', encoding='utf-8') as f:
+            json.dump({'version': SNAPSHOT_VERSION, 'posts': rows}, f, separators=(',', ':'))
+        os.replace(filename + '.tmp', filename)
+    except OSError as e:
+        logger.warning("Could not save the snapshot of the New view: %s", str(e))
+
+
+@log
+def load_snapshot(path=CACHE_PATH):
+    """Get the posts saved by save_snapshot()
+
+    The path of the cached thumbnail of each post is looked up under the
+    'thumbnail' key. Thumbnails which are gone from the cache or stale since
+    are left out.
+
+    Returns:
+        list of posts, empty if there is no usable snapshot
+    """
+    filename = os.path.join(os.path.expanduser(path), SNAPSHOT_FILENAME)
+    try:
+        with gzip.open(filename, 'rt', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return []
+    except (OSError, EOFError, ValueError) as e:
+        logger.warning("Could not load the snapshot of the New view: %s", str(e))
+        return []
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        return []
+
+    cache = ThumbnailCache.get_default()
+    posts = snapshot['posts']
+    for post in posts:
+        if post['date'] is not None:
+            post['date'] = GLib.DateTime.new_from_unix_local(post['date'])
+        post['thumbnail'] = None
+        if post['content_hash']:
+            post['thumbnail'] = cache.lookup(post['url'], post['content_hash'])
+    return posts
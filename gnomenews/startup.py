@@ -0,0 +1,43 @@
+# Copyright (C) 2015 Vadim Rutkovsky <vrutkovs@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+import time
+
+from gnomenews.tracing import tracer
+import logging
+logger = logging.getLogger(__name__)
+
+# Imported by the launcher before anything else, so the phases are timed
+# from about when the process started
+START_TIME = time.monotonic()
+
+# Phase name -> ms since START_TIME, in the order the phases were reached
+phases = OrderedDict()
+
+
+def mark(phase):
+    """Remember that a startup phase was reached
+
+    Only the first time a phase is reached counts.
+
+    Args:
+        phase (str): name of the phase, e.g. 'first-frame'.
+    """
+    if phase in phases:
+        return
+    phases[phase] = (time.monotonic() - START_TIME) * 1000
+    tracer.instant('startup:' + phase)
+    logger.info("Startup phase %s reached after %.1f ms", phase, phases[phase])
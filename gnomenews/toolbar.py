@@ -60,6 +60,8 @@ class Toolbar(GObject.GObject):
         self._back_button.connect('clicked', self.window.on_back_button_clicked)
 
         self._search_button = self._ui.get_object('search-button')
+        self._search_button.bind_property('active', self.window.search_bar, 'search-mode-enabled',
+                                          GObject.BindingFlags.BIDIRECTIONAL)
 
         self.set_state(ToolbarState.MAIN)
 
@@ -98,7 +100,7 @@ class Toolbar(GObject.GObject):
         else:
             self.reset_header_title()
 
-        self._search_button.set_visible(self._state != ToolbarState.SEARCH_VIEW)
+        self._search_button.set_visible(self._state != ToolbarState.CHILD_VIEW)
         self._back_button.set_visible(self._state == ToolbarState.CHILD_VIEW)
         self.add_toggle_button.set_visible(self._state != ToolbarState.CHILD_VIEW)
 
@@ -126,9 +128,20 @@ class Toolbar(GObject.GObject):
                 self.add_button.set_sensitive(False)
                 already_subscribed_label.set_visible(False)
                 return
-            if len(self.window.tracker.get_channels(text)) == 0:
-                already_subscribed_label.set_visible(False)
-                self.add_button.set_sensitive(True)
-            else:
-                self.add_button.set_sensitive(False)
-                already_subscribed_label.set_visible(True)
+            # The full channel list is looked up rather than the typed URL,
+            # so every keystroke is answered from the query cache
+            self.window.tracker.get_channels(
+                callback=lambda channels: self._update_add_button(text, channels))
+
+    def _update_add_button(self, text, channels):
+        # The entry could have been changed while the query was running
+        if text != self.new_url.get_text():
+            return
+
+        already_subscribed_label = self._ui.get_object("add-box-already-subscribed-label")
+        if not any(channel['url'] == text for channel in channels):
+            already_subscribed_label.set_visible(False)
+            self.add_button.set_sensitive(True)
+        else:
+            self.add_button.set_sensitive(False)
+            already_subscribed_label.set_visible(True)
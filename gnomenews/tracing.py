@@ -0,0 +1,270 @@
+# Copyright (C) 2015 Vadim Rutkovsky <vrutkovs@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import deque
+import bisect
+import json
+import os
+import os.path
+import random
+import sys
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Path of the trace file, or 1 for a file in TRACE_PATH. Tracing is on from
+# the start if set.
+TRACE_ENV = 'GNOME_NEWS_TRACE'
+# Fraction of the outermost spans recorded, their children are recorded
+# with them
+TRACE_SAMPLE_ENV = 'GNOME_NEWS_TRACE_SAMPLE'
+TRACE_PATH = "~/.cache/gnome-news"
+# Only the last this many spans are kept for the trace file
+MAX_EVENTS = 200000
+# Upper bounds in microseconds of the buckets of the timing histograms
+HISTOGRAM_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+# Spans taking longer than this many seconds are logged
+SLOW_SPAN = 0.5
+
+
+class FunctionStats:
+    """Aggregated timings of the spans of one name"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # One bucket per bound in HISTOGRAM_BUCKETS and one for the rest
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+
+    def add(self, duration):
+        """
+        Args:
+            duration (float): duration of a span in microseconds.
+        """
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.buckets[bisect.bisect_left(HISTOGRAM_BUCKETS, duration)] += 1
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total_us': round(self.total),
+            'max_us': round(self.max),
+            'histogram': dict(zip(['<=%dus' % b for b in HISTOGRAM_BUCKETS] + ['more'],
+                                  self.buckets)),
+        }
+
+
+class Tracer:
+    """Records how long functions take, with their nesting
+
+    Spans are timed with the monotonic clock and kept as complete events of
+    the Chrome trace format, which chrome://tracing and Perfetto show as a
+    timeline. Timings are also aggregated per function into histograms.
+
+    Traced functions are only registered, not wrapped, so they cost nothing
+    while tracing is off. While it is on, a profile hook installed with
+    sys.setprofile() and threading.setprofile() turns calls of registered
+    functions into spans. The hook is installed for the thread switching
+    tracing on, usually the main one, and for threads started afterwards.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.path = None
+        self.events = deque(maxlen=MAX_EVENTS)
+        # Span name -> FunctionStats
+        self.stats = {}
+        # Code object of a traced function -> (span name, category)
+        self._functions = {}
+        self._start = time.monotonic()
+        self._local = threading.local()
+
+    def enable(self, path=None, sample_rate=1.0):
+        """Start recording spans, dropping those of an earlier recording
+
+        Args:
+            path (Optional[str]): where write() puts the trace.
+            sample_rate (Optional[float]): fraction of the outermost spans
+                                           to record.
+        """
+        self.path = path or os.path.join(os.path.expanduser(TRACE_PATH),
+                                         'trace-%d.json' % os.getpid())
+        self.sample_rate = sample_rate
+        self.events.clear()
+        self.stats.clear()
+        # Spans left open when tracing was switched off never end
+        self._local.stack = []
+        self.enabled = True
+        threading.setprofile(self._profile)
+        sys.setprofile(self._profile)
+        logger.info("Tracing to %s", self.path)
+
+    def disable(self):
+        """Stop recording spans and write the trace"""
+        if not self.enabled:
+            return
+        sys.setprofile(None)
+        threading.setprofile(None)
+        self.enabled = False
+        self.write()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def register(self, fn):
+        """Trace calls of the function as spans of their own"""
+        self._functions[fn.__code__] = ('%s.%s' % (fn.__module__, fn.__qualname__),
+                                        fn.__module__)
+
+    def _profile(self, frame, event, arg):
+        if event == 'call':
+            function = self._functions.get(frame.f_code)
+            if function:
+                self._begin(*function)
+        elif event == 'return':
+            function = self._functions.get(frame.f_code)
+            # Calls which started before tracing was switched on are skipped
+            if function and self._stack() and self._stack()[-1][0] == function[0]:
+                self._end()
+
+    def span(self, name, category='gnomenews'):
+        """Context manager recording the enclosed code as a span
+
+        Args:
+            name (str): name of the span.
+            category (Optional[str]): category to filter spans by in the
+                                      trace viewer.
+        """
+        return Span(self, name, category)
+
+    def instant(self, name):
+        """Record a point in time, e.g. a startup phase"""
+        if self.enabled:
+            self.events.append({
+                'name': name, 'ph': 'i', 's': 'g',
+                'ts': (time.monotonic() - self._start) * 1e6,
+                'pid': os.getpid(), 'tid': threading.get_ident(),
+            })
+
+    def _begin(self, name, category):
+        stack = self._stack()
+        if stack:
+            # Children are recorded along with their parent or not at all
+            sampled = stack[-1][2]
+        else:
+            sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        stack.append((name, category, sampled, time.monotonic()))
+
+    def _end(self):
+        end = time.monotonic()
+        stack = self._stack()
+        name, category, sampled, start = stack.pop()
+        if not sampled:
+            return
+
+        duration = (end - start) * 1e6
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = FunctionStats()
+        stats.add(duration)
+
+        event = {
+            'name': name, 'cat': category, 'ph': 'X',
+            'ts': (start - self._start) * 1e6, 'dur': duration,
+            'pid': os.getpid(), 'tid': threading.get_ident(),
+        }
+        if stack:
+            event['args'] = {'parent': stack[-1][0]}
+        self.events.append(event)
+
+        if duration > SLOW_SPAN * 1e6:
+            logger.debug("%s took %.3f s", name, duration / 1e6)
+
+    def write(self, path=None):
+        """Write the recorded spans and the histograms as a Chrome trace
+
+        Args:
+            path (Optional[str]): where to write the trace, the path given
+                                  to enable() by default.
+        """
+        path = path or self.path
+        if not path:
+            return
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        trace = {
+            'traceEvents': list(self.events),
+            'displayTimeUnit': 'ms',
+            'stats': {name: stats.as_dict() for name, stats in self.stats.items()},
+        }
+        try:
+            with open(path, 'w') as f:
+                json.dump(trace, f)
+        except OSError as e:
+            logger.warning("Could not write the trace: %s", str(e))
+            return
+        logger.info("Wrote %d spans to %s", len(self.events), path)
+
+
+class Span:
+    """Span of a Tracer, see Tracer.span()"""
+
+    __slots__ = ('tracer', 'name', 'category', 'recording')
+
+    def __init__(self, tracer, name, category):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.recording = False
+
+    def __enter__(self):
+        # A span started while tracing is off isn't recorded, even if
+        # tracing is switched on before it ends
+        self.recording = self.tracer.enabled
+        if self.recording:
+            self.tracer._begin(self.name, self.category)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.recording:
+            self.tracer._end()
+        return False
+
+
+tracer = Tracer()
+
+
+def enable_from_environment():
+    """Switch tracing on if GNOME_NEWS_TRACE is set"""
+    value = os.environ.get(TRACE_ENV)
+    if not value:
+        return
+    try:
+        sample_rate = float(os.environ.get(TRACE_SAMPLE_ENV, 1))
+    except ValueError:
+        logger.warning("Invalid %s, recording all spans", TRACE_SAMPLE_ENV)
+        sample_rate = 1.0
+    tracer.enable(None if value == '1' else value, sample_rate)
@@ -14,45 +14,122 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from gi.repository import GLib, GObject, Gio, Tracker as Trackr
+from gi.repository import GLib, Gio, Tracker as Trackr
+
+from collections import OrderedDict
+import re
 
 from gnomenews import log
+from gnomenews.backend import StorageBackend, SNIPPET_LENGTH, search_terms
 import logging
 logger = logging.getLogger(__name__)
 
+FEED_MESSAGE_CLASS = "http://www.tracker-project.org/temp/mfo#FeedMessage"
+FEED_CHANNEL_CLASS = "http://www.tracker-project.org/temp/mfo#FeedChannel"
 
-class Tracker(GObject.GObject):
+# Change notifications are folded together until no new one arrived for
+# BATCH_WINDOW ms, but never held back for longer than BATCH_MAX_LATENCY ms
+BATCH_WINDOW = 250
+BATCH_MAX_LATENCY = 1000
 
-    __gsignals__ = {
-        #'new-item': (GObject.SignalFlags.RUN_FIRST, None, (Grss.FeedChannel, Grss.FeedItem)),
-        'items-updated': (GObject.SignalFlags.RUN_LAST, None, ()),
-        'feeds-updated': (GObject.SignalFlags.RUN_LAST, None, ()),
-    }
+# Number of recently opened posts whose full HTML is kept
+CONTENT_CACHE_SIZE = 32
 
-    @log
-    def __init__(self):
-        GObject.GObject.__init__(self)
-        bus = Gio.bus_get_sync(Gio.BusType.SESSION, None)
-        bus.signal_subscribe(
-            "org.freedesktop.Tracker1",
-            "org.freedesktop.Tracker1.Resources",
-            "GraphUpdated",
-            "/org/freedesktop/Tracker1/Resources",
-            "http://www.tracker-project.org/temp/mfo#FeedMessage",
-            Gio.DBusSignalFlags.NONE,
-            self.on_graph_updated)
-        self.sparql = Trackr.SparqlConnection.get(None)
-
-    @log
-    def get_post_sorted_by_date(self, amount, unread=False, read_only=False, starred=False):
-        query = """
-        SELECT
+# Number of channels whose posts are fetched by a single query
+CHANNEL_BATCH_SIZE = 20
+
+# Number of query results kept and their lifetime in seconds
+QUERY_CACHE_SIZE = 64
+QUERY_CACHE_TTL = 300
+# Number of split query templates kept
+TEMPLATE_CACHE_SIZE = 64
+# Rows of streamed query results are passed on in chunks of this size
+STREAM_CHUNK_SIZE = 10
+
+# Read and starred state changes are collected for this many ms and written
+# to Tracker together
+WRITE_FLUSH_INTERVAL = 500
+
+POST_SUMMARY_COLUMNS = """
+          tracker:id(?msg) AS id
           nie:url(?msg) AS url
           nie:title(?msg) AS title
           nco:fullname(?creator) AS fullname
           nie:contentCreated(?msg) AS date
-          nmo:htmlMessageContent(?msg) AS content
+          fn:substring(nmo:htmlMessageContent(?msg), 1, %d) AS snippet
           nmo:isRead(?msg) AS is_read
+          nie:url(nmo:communicationChannel(?msg)) AS channel""" % SNIPPET_LENGTH
+
+
+class Tracker(StorageBackend):
+    """Storage backend using the feeds fetched by tracker-miner-rss"""
+
+    fetches_feeds = True
+
+    @log
+    def __init__(self, batch_window=BATCH_WINDOW, batch_max_latency=BATCH_MAX_LATENCY,
+                 connection=None):
+        """
+        Args:
+            batch_window (Optional[int]): quiet period in ms after which
+                                          pending change events are delivered.
+            batch_max_latency (Optional[int]): upper bound in ms for holding
+                                               back a change event.
+            connection (Optional[Trackr.SparqlConnection]): connection to
+                use, a new one is set up synchronously if not given.
+        """
+        StorageBackend.__init__(self)
+        self.batcher = EventBatcher(self._handle_events, batch_window, batch_max_latency)
+        bus = Gio.bus_get_sync(Gio.BusType.SESSION, None)
+        for class_name in (FEED_MESSAGE_CLASS, FEED_CHANNEL_CLASS):
+            bus.signal_subscribe(
+                "org.freedesktop.Tracker1",
+                "org.freedesktop.Tracker1.Resources",
+                "GraphUpdated",
+                "/org/freedesktop/Tracker1/Resources",
+                class_name,
+                Gio.DBusSignalFlags.NONE,
+                self.on_graph_updated)
+        self.sparql = connection or Trackr.SparqlConnection.get(None)
+
+        # Tracker IDs of posts and channels seen so far mapped to their URLs.
+        # GraphUpdated only carries IDs and deleted resources can't be
+        # queried anymore, so this is the only way to tell which URL is gone.
+        self._urls = {}
+
+        # Full HTML of recently opened posts, by URL
+        self._content_cache = OrderedDict()
+        self.query_cache = QueryCache()
+        # Query template -> SparqlTemplate, least recently used first
+        self._templates = OrderedDict()
+
+        # Pending updates in the order they were requested, keyed so that a
+        # later change of the same property of the same resource replaces
+        # the earlier one
+        self._pending_writes = OrderedDict()
+        self._write_flush_id = None
+
+        # Local full text index answering searches, if enabled
+        self.search_index = None
+
+    @log
+    def get_post_sorted_by_date(self, amount, unread=False, read_only=False, starred=False,
+                                after=None, callback=None):
+        """Get posts, newest first
+
+        Args:
+            amount (int): number of items to fetch.
+            unread (Optional[bool]): return only unread items if True.
+            read_only (Optional[bool]): return only read items if True.
+            starred (Optional[bool]): return only starred items if True.
+            after (Optional[tuple]): (date, url) of the last post of the
+                                     previous page, to continue from.
+            callback (Optional[callable]): run the query asynchronously and
+                                           pass the list of posts to callback.
+        """
+        query = """
+        SELECT %s""" % POST_SUMMARY_COLUMNS
+        query += """
         WHERE
           { ?msg a mfo:FeedMessage """
 
@@ -65,20 +142,45 @@ class Tracker(GObject.GObject):
         if starred:
             query += "; nao:hasTag nao:predefined-tag-favorite "
 
-        query += """; nco:creator ?creator }
-        ORDER BY DESC (nie:contentCreated(?msg))
-        LIMIT %s
-        """ % amount
+        query += """; nco:creator ?creator %s }
+        ORDER BY DESC (nie:contentCreated(?msg)) DESC (nie:url(?msg))
+        LIMIT ~limit
+        """ % self._keyset_filter(after)
 
-        logger.debug(query)
-        results = self.sparql.query(query)
-        ret = []
-        while (results.next(None)):
-            ret.append(self.parse_sparql(results))
-        return ret
+        params = {'limit': amount}
+        params.update(self._keyset_params(after))
+        return self._run_query(query, callback, cache_class=FEED_MESSAGE_CLASS, params=params)
+
+    @staticmethod
+    def _keyset_filter(after):
+        """Build a FILTER selecting posts ordered after the given one
+
+        Posts are ordered by creation date and URL, both descending, so the
+        pair is a unique key to continue a listing from.
+        """
+        if after is None:
+            return ""
+
+        return """
+          FILTER (nie:contentCreated(?msg) < ~after_date ||
+                  (nie:contentCreated(?msg) = ~after_date &&
+                   nie:url(?msg) < ~after_url))"""
+
+    @staticmethod
+    def _keyset_params(after):
+        if after is None:
+            return {}
+        return {'after_date': after[0], 'after_url': after[1]}
 
     @log
-    def get_info_for_entry(self, url):
+    def get_info_for_entry(self, url, callback=None):
+        """Get title and author of the post
+
+        Args:
+            url (str): URL of the post.
+            callback (Optional[callable]): run the query asynchronously and
+                                           pass the result to callback.
+        """
         query = """
         SELECT
           nie:title(?msg) AS title
@@ -86,17 +188,57 @@ class Tracker(GObject.GObject):
         WHERE
           { ?msg a mfo:FeedMessage ;
             nco:creator ?creator ;
-            nie:url <%s> }""" % url
+            nie:url ~url }"""
 
-        logger.debug(query)
-        results = self.sparql.query(query)
-        ret = []
-        while (results.next(None)):
-            ret.append(self.parse_sparql(results))
+        params = {'url': url}
+        if callback:
+            self._run_query(query, lambda ret: callback(self._single_entry(ret, url)),
+                            params=params)
+        else:
+            return self._single_entry(self._run_query(query, params=params), url)
+
+    @staticmethod
+    def _single_entry(ret, url):
         if len(ret) != 1:
             raise Exception("More than one result returned by feed with url %s" % url)
         return ret[0]
 
+    @log
+    def get_post_content(self, url, callback=None):
+        """Get the full HTML content of the post
+
+        Recently fetched contents are kept in a small cache.
+
+        Args:
+            url (str): URL of the post.
+            callback (Optional[callable]): run the query asynchronously and
+                                           pass the content to callback.
+        """
+        if url in self._content_cache:
+            self._content_cache.move_to_end(url)
+            content = self._content_cache[url]
+            return self._reply(content, callback)
+
+        query = """
+        SELECT
+          nmo:htmlMessageContent(?msg) AS content
+        WHERE
+          { ?msg a mfo:FeedMessage ;
+                 nie:url ~url }"""
+        params = {'url': url}
+
+        def store(ret):
+            content = ret[0]['content'] if ret else None
+            self._content_cache[url] = content
+            while len(self._content_cache) > CONTENT_CACHE_SIZE:
+                self._content_cache.popitem(last=False)
+            return content
+
+        if callback:
+            self._run_query(query, lambda ret: callback(store(ret)), params=params)
+        else:
+            return store(self._run_query(query, params=params))
+
     @log
     def add_channel(self, url, update_interval=30):
         """Add channel to fetching by tracker
@@ -106,38 +248,219 @@ class Tracker(GObject.GObject):
             update_interval (Optional[int]): Update interval in minutes.
                                              Don't use less than 1 minute.
         """
-        self.sparql.update("""
+        self._run_update("""
         INSERT {
           _:FeedSettings a mfo:FeedSettings ;
-                           mfo:updateInterval %i .
+                           mfo:updateInterval ~interval .
           _:Feed a nie:DataObject, mfo:FeedChannel ;
                    mfo:feedSettings _:FeedSettings ;
-                   nie:url "%s" }
-        """ % (update_interval, url), GLib.PRIORITY_DEFAULT, None)
+                   nie:url ~url }
+        """, {'interval': update_interval, 'url': url})
 
     @log
-    def mark_post_as_read(self, caller, url, data=None):
-        """Marks given post as read
+    def add_channels(self, urls, update_interval=30, callback=None):
+        """Add several channels with a single update
 
         Args:
-            url (str): URL of the post.
-            data (Optional): user data.
+            urls (list): URLs of the channels.
+            update_interval (Optional[int]): Update interval in minutes.
+            callback (Optional[callable]): run the update asynchronously and
+                                           call callback once it is done.
         """
+        if not urls:
+            if callback:
+                GLib.idle_add(callback)
+            return
+        template = "INSERT {"
+        params = {'interval': update_interval}
+        for i, url in enumerate(urls):
+            template += """
+          _:FeedSettings%d a mfo:FeedSettings ;
+                            mfo:updateInterval ~interval .
+          _:Feed%d a nie:DataObject, mfo:FeedChannel ;
+                    mfo:feedSettings _:FeedSettings%d ;
+                    nie:url ~url%d .""" % (i, i, i, i)
+            params['url%d' % i] = url
+        template += " }"
+        if callback is None:
+            self._run_update(template, params)
+            return
 
-        query = """
+        query = self._template(template).format(params)
+        logger.debug(query)
+        self.sparql.update_async(query, GLib.PRIORITY_DEFAULT, None,
+                                 self._on_update_done, callback)
+
+    def _on_update_done(self, connection, result, callback):
+        try:
+            connection.update_finish(result)
+        except GLib.Error as e:
+            logger.error("Could not run update: %s", e)
+        callback()
+
+    @log
+    def set_update_interval(self, url, update_interval):
+        """Queue a change of the update interval of the channel
+
+        Args:
+            url (str): URL of the channel.
+            update_interval (int): Update interval in minutes.
+        """
+        self._queue_write(('interval', url), """
+        DELETE
+          { ?settings mfo:updateInterval ?any }
+        WHERE
+          { ?chan nie:url ~url;
+                  mfo:feedSettings ?settings .
+            ?settings mfo:updateInterval ?any }
+        INSERT
+          { ?settings mfo:updateInterval ~interval }
+        WHERE
+          { ?chan nie:url ~url;
+                  mfo:feedSettings ?settings }
+        """, {'url': url, 'interval': update_interval})
+
+    @log
+    def set_post_read(self, url, read=True):
+        """Queue a change of the read state of the post
+
+        Args:
+            url (str): URL of the post.
+            read (Optional[bool]): new state.
+        """
+        self._queue_write(('read', url), """
         DELETE
           { ?msg nmo:isRead ?any }
         WHERE
-          { ?msg nie:url "%s";
+          { ?msg nie:url ~url;
                  nmo:isRead ?any }
+        INSERT
+          { ?msg nmo:isRead ~read }
+        WHERE
+          { ?msg nie:url ~url }
+        """, {'url': url, 'read': read})
+
+    @log
+    def set_post_starred(self, url, starred=True):
+        """Queue a change of the starred state of the post
+
+        Args:
+            url (str): URL of the post.
+            starred (Optional[bool]): new state.
+        """
+        if starred:
+            template = """
+        INSERT
+          { ?msg nao:hasTag nao:predefined-tag-favorite }
+        WHERE
+          { ?msg nie:url ~url }
+        """
+        else:
+            template = """
+        DELETE
+          { ?msg nao:hasTag nao:predefined-tag-favorite }
+        WHERE
+          { ?msg nie:url ~url }
+        """
+        self._queue_write(('starred', url), template, {'url': url})
+
+    @log
+    def mark_channel_as_read(self, url):
+        """Queue marking all posts of the channel as read
+
+        Args:
+            url (str): URL of the channel.
+        """
+        self._queue_write(('read-channel', url), """
+        DELETE
+          { ?msg nmo:isRead ?any }
+        WHERE
+          { ?msg nmo:communicationChannel ?chan;
+                 nmo:isRead ?any .
+            ?chan nie:url ~url }
         INSERT
           { ?msg nmo:isRead true }
         WHERE
-          { ?msg nie:url "%s" }
-        """ % (url, url)
+          { ?msg a mfo:FeedMessage;
+                 nmo:communicationChannel ?chan .
+            ?chan nie:url ~url }
+        """, {'url': url})
 
-        logger.debug(query)
-        self.sparql.update(query, GLib.PRIORITY_DEFAULT, None)
+    @log
+    def mark_all_as_read(self, before=None):
+        """Queue marking all posts as read
+
+        Args:
+            before (Optional[GLib.DateTime]): only mark posts created before
+                                              this date.
+        """
+        params = {}
+        date_filter = ""
+        if before is not None:
+            date_filter = "FILTER (nie:contentCreated(?msg) < ~before)"
+            params['before'] = before
+
+        self._queue_write(('read-all', before and before.to_unix()), """
+        DELETE
+          { ?msg nmo:isRead ?any }
+        WHERE
+          { ?msg a mfo:FeedMessage;
+                 nmo:isRead ?any
+            %s }
+        INSERT
+          { ?msg nmo:isRead true }
+        WHERE
+          { ?msg a mfo:FeedMessage
+            %s }
+        """ % (date_filter, date_filter), params)
+
+    @log
+    def _queue_write(self, key, template, params):
+        self._pending_writes.pop(key, None)
+        self._pending_writes[key] = self._template(template).format(params)
+        if not self._write_flush_id:
+            self._write_flush_id = GLib.timeout_add(WRITE_FLUSH_INTERVAL, self._on_write_timeout)
+
+    def _on_write_timeout(self):
+        self._write_flush_id = None
+        self.flush_writes(wait=False)
+        return False
+
+    @log
+    def flush_writes(self, wait=True):
+        """Write all queued changes to Tracker
+
+        Args:
+            wait (Optional[bool]): block until the changes are written,
+                                   used at shutdown.
+        """
+        if self._write_flush_id:
+            GLib.source_remove(self._write_flush_id)
+            self._write_flush_id = None
+        if not self._pending_writes:
+            return
+
+        updates = list(self._pending_writes.values())
+        self._pending_writes.clear()
+        logger.debug("Writing %d queued updates", len(updates))
+        if wait:
+            try:
+                self.sparql.update('\n'.join(updates), GLib.PRIORITY_DEFAULT, None)
+            except GLib.Error as e:
+                logger.error("Could not write updates: %s", e)
+        else:
+            self.sparql.update_array_async(updates, GLib.PRIORITY_DEFAULT, None,
+                                           self._on_writes_done, None)
+
+    def _on_writes_done(self, connection, result, data):
+        try:
+            errors = connection.update_array_finish(result)
+        except GLib.Error as e:
+            logger.error("Could not write updates: %s", e)
+            return
+        for error in errors or []:
+            if error:
+                logger.error("Could not write update: %s", error)
 
     @log
     def remove_channel(self, url):
@@ -146,54 +469,111 @@ class Tracker(GObject.GObject):
         Args:
             url (str): URL of the channel.
         """
-        query = """
+        self._run_update("""
         DELETE
           { ?chan a mfo:FeedChannel }
         WHERE
-          { ?chan nie:url "%s" }""" % url
-        self.sparql.update(query, GLib.PRIORITY_DEFAULT, None)
-        self.emit('feeds-updated')
+          { ?chan nie:url ~url }""", {'url': url})
 
     @log
-    def get_posts_for_channel(self, url, amount):
+    def get_posts_for_channel(self, url, amount, after=None, callback=None):
         """Get posts for channel id
 
         Args:
             url (str): URL of the channel.
             amount (int): number of items to fetch.
-            unread (Optional[bool]): return only unread items if True.
+            after (Optional[tuple]): (date, url) of the last post of the
+                                     previous page, to continue from.
+            callback (Optional[callable]): run the query asynchronously and
+                                           pass the list of posts to callback.
         """
         query = """
-        SELECT
-          nie:url(?msg) AS url
-          nie:title(?msg) AS title
-          nco:fullname(?creator) AS fullname
-          nie:contentCreated(?msg) AS date
-          nmo:htmlMessageContent(?msg) AS content
-          nmo:isRead(?msg) AS is_read
+        SELECT %s""" % POST_SUMMARY_COLUMNS
+        query += """
           { ?msg a mfo:FeedMessage;
                  nmo:communicationChannel ?chan"""
 
         query += """; nco:creator ?creator
-                 { ?chan nie:url "%s" }
+                 { ?chan nie:url ~channel } %s
           }
-        ORDER BY DESC (nie:contentCreated(?msg))
-        LIMIT %s
-        """ % (url, amount)
+        ORDER BY DESC (nie:contentCreated(?msg)) DESC (nie:url(?msg))
+        LIMIT ~limit
+        """ % self._keyset_filter(after)
 
-        logger.debug(query)
-        results = self.sparql.query(query)
-        ret = []
-        while (results.next(None)):
-            ret.append(self.parse_sparql(results))
-        return ret
+        params = {'channel': url, 'limit': amount}
+        params.update(self._keyset_params(after))
+        return self._run_query(query, callback, cache_class=FEED_MESSAGE_CLASS, params=params)
 
     @log
-    def get_channels(self, url=None):
+    def get_posts_for_channels(self, urls, amount, callback=None):
+        """Get the newest posts of several channels at once
+
+        Each query covers CHANNEL_BATCH_SIZE channels, so previews of many
+        channels take a few round-trips instead of one per channel.
+
+        Args:
+            urls (list): URLs of the channels.
+            amount (int): number of items to fetch per channel.
+            callback (Optional[callable]): run the queries asynchronously and
+                                           pass the result to callback.
+
+        Returns:
+            dict mapping channel URLs to their lists of posts
+        """
+        queries = []
+        for i in range(0, len(urls), CHANNEL_BATCH_SIZE):
+            subqueries = []
+            params = {'limit': amount}
+            for n, url in enumerate(urls[i:i + CHANNEL_BATCH_SIZE]):
+                subqueries.append("""
+            { SELECT %s
+              { ?msg a mfo:FeedMessage;
+                     nmo:communicationChannel ?chan;
+                     nco:creator ?creator
+                     { ?chan nie:url ~channel%d }
+              }
+              ORDER BY DESC (nie:contentCreated(?msg)) DESC (nie:url(?msg))
+              LIMIT ~limit
+            }""" % (POST_SUMMARY_COLUMNS, n))
+                params['channel%d' % n] = url
+
+            queries.append(("""
+        SELECT ?id ?url ?title ?fullname ?date ?snippet ?is_read ?channel
+          { %s
+          }""" % "\n            UNION".join(subqueries), params))
+
+        ret = dict((url, []) for url in urls)
+
+        def group(rows):
+            for row in rows:
+                ret.setdefault(row['channel'], []).append(row)
+
+        if callback is None:
+            for query, params in queries:
+                group(self._run_query(query, cache_class=FEED_MESSAGE_CLASS, params=params))
+            return ret
+
+        pending = [len(queries)]
+
+        def on_results(rows):
+            group(rows)
+            pending[0] -= 1
+            if pending[0] == 0:
+                callback(ret)
+
+        if not queries:
+            self._reply(ret, callback)
+        for query, params in queries:
+            self._run_query(query, on_results, cache_class=FEED_MESSAGE_CLASS, params=params)
+
+    @log
+    def get_channels(self, url=None, callback=None):
         """Returns list of channels
 
         Args:
             url (Optional[str]): URL of the channel
+            callback (Optional[callable]): run the query asynchronously and
+                                           pass the list of channels to callback.
 
         Returns:
             list of all channels of list limited to one channel if url is
@@ -201,72 +581,389 @@ class Tracker(GObject.GObject):
         """
         query = """
         SELECT
+          tracker:id(?chan) AS id
           nie:url(?chan) AS url
           nie:title(?chan) AS title
+          mfo:updateInterval(mfo:feedSettings(?chan)) AS update_interval
           { ?chan a mfo:FeedChannel"""
 
+        params = {}
         if url is not None:
-            query += """; nie:url "%s" """ % url
+            query += """; nie:url ~url """
+            params['url'] = url
         query += """
           }
         ORDER BY nie:title(?chan)
         """
 
-        results = self.sparql.query(query)
-        ret = []
-        while (results.next(None)):
-            ret.append(self.parse_sparql(results))
-        return ret
+        return self._run_query(query, callback, cache_class=FEED_CHANNEL_CLASS, params=params)
 
     @log
-    def get_text_matches(self, text, amount, channel=None):
+    def iter_channels(self):
+        """Iterate over all channels without collecting them in a list
+
+        Yields:
+            dict with url and title of the channel
+        """
+        cursor = self.sparql.query("""
+        SELECT
+          nie:url(?chan) AS url
+          nie:title(?chan) AS title
+          { ?chan a mfo:FeedChannel }
+        ORDER BY nie:title(?chan)
+        """, None)
+        try:
+            while cursor.next(None):
+                yield self.parse_sparql(cursor)
+        finally:
+            cursor.close()
+
+    @log
+    def get_text_matches(self, text, amount, channel=None, callback=None,
+                         cancellable=None, progress=None, within=None):
         """Do text search lookup
 
+        The last word of the text matches as prefix, so results can be
+        shown while the word is being typed.
+
         Args:
             text (str): text to search for.
-            channel (str): URL of the channel.
             amount (int): number of items to fetch.
+            channel (Optional[str]): URL of the channel.
+            callback (Optional[callable]): run the query asynchronously and
+                                           pass the list of posts to callback.
+            cancellable (Optional[Gio.Cancellable]): cancels the asynchronous
+                                                     query, callback is not
+                                                     called then.
+            progress (Optional[callable]): receives the posts in chunks while
+                                           they are read.
+            within (Optional[list]): Tracker IDs of the posts to search
+                                     among, e.g. the results of a search
+                                     for a prefix of the text.
         """
+        terms = search_terms(text)
+        if not terms:
+            return self._reply([], callback)
+
+        if self.search_index and self.search_index.ready:
+            ret = self.search_index.search(text, amount, channel, within=within)
+            # Changes of the posts found are signalled like for queries
+            self._remember_urls(ret)
+            return self._reply(ret, callback, cancellable)
+
         query = """
-        SELECT
-          nie:url(?msg) AS url
-          nie:title(?msg) AS title
-          nco:fullname(?creator) AS fullname
-          nie:contentCreated(?msg) AS date_created
-          nmo:htmlMessageContent(?msg) AS content
-          nmo:isRead(?msg) AS is_read
-          { ?msg a mfo:FeedMessage; """
+        SELECT %s""" % POST_SUMMARY_COLUMNS
+        query += """
+          { ?msg a mfo:FeedMessage;
+                 fts:match ~text;
+                 nco:creator ?creator"""
+        params = {'text': ' '.join(terms) + '*', 'limit': amount}
 
         if channel:
-            query += """nmo:communicationChannel ?chan;"""
+            query += """;
+                 nmo:communicationChannel ?chan
+                 { ?chan nie:url ~channel }"""
+            params['channel'] = channel
+
+        if within is not None:
+            if not within:
+                return self._reply([], callback)
+            query += """
+            FILTER (tracker:id(?msg) IN (%s))""" % ', '.join(str(int(i)) for i in within)
 
         query += """
-                 fts:match "%s";
-                 nco:creator ?creator
-                 { ?chan nie:url "%s" }
           }
         ORDER BY fts:rank(?msg)
-        LIMIT %d
-        """ % (text, channel, amount)
+        LIMIT ~limit
+        """
 
-        logger.debug(query)
-        results = self.sparql.query(query)
-        ret = []
-        while (results.next(None)):
-            ret.append(self.parse_sparql(results))
+        return self._run_query(query, callback, cache_class=FEED_MESSAGE_CLASS, params=params,
+                               cancellable=cancellable, progress=progress)
+
+    @log
+    def enable_search_index(self):
+        """Answer text searches from a local SearchIndex
+
+        Tracker searches until the index has been built in the background.
+        """
+        if self.search_index is None:
+            from gnomenews.searchindex import SearchIndex
+            self.search_index = SearchIndex(self)
+            self.search_index.start()
+
+    @log
+    def get_post_ids(self, callback=None):
+        """Get the Tracker IDs of all posts
+
+        Args:
+            callback (Optional[callable]): run the query asynchronously and
+                                           pass the list of IDs to callback.
+        """
+        query = """
+        SELECT
+          tracker:id(?msg) AS id
+        WHERE
+          { ?msg a mfo:FeedMessage }"""
+
+        if callback:
+            self._run_query(query, lambda rows: callback([row['id'] for row in rows]))
+        else:
+            return [row['id'] for row in self._run_query(query)]
+
+    @log
+    def get_index_documents(self, ids=None, after_id=None, amount=None, callback=None):
+        """Get posts with their full content, ordered by Tracker ID
+
+        Args:
+            ids (Optional[list]): Tracker IDs of the posts to get.
+            after_id (Optional[int]): get posts with higher IDs only.
+            amount (Optional[int]): number of items to fetch.
+            callback (callable): receives the list of posts.
+        """
+        query = """
+        SELECT %s""" % POST_SUMMARY_COLUMNS
+        query += """
+          nmo:htmlMessageContent(?msg) AS content
+          BOUND(?tag) AS starred
+          { ?msg a mfo:FeedMessage
+            OPTIONAL { ?msg nco:creator ?creator }
+            OPTIONAL { ?msg nao:hasTag ?tag
+                       FILTER (?tag = nao:predefined-tag-favorite) }"""
+        if ids is not None:
+            if not ids:
+                return self._reply([], callback)
+            query += """
+            FILTER (tracker:id(?msg) IN (%s))""" % ', '.join(str(int(i)) for i in ids)
+        if after_id is not None:
+            query += """
+            FILTER (tracker:id(?msg) > %d)""" % after_id
+        query += """
+          }
+        ORDER BY tracker:id(?msg)"""
+        if amount is not None:
+            query += """
+        LIMIT %d""" % amount
+
+        return self._run_query(query, callback)
+
+    @staticmethod
+    def _reply(ret, callback, cancellable=None):
+        """Return the result, or pass it to the callback from the main loop"""
+        if callback:
+            def deliver():
+                if not (cancellable and cancellable.is_cancelled()):
+                    callback(ret)
+                return False
+            GLib.idle_add(deliver)
+            return
+        return ret
+
+    @log
+    def _template(self, template):
+        """Get the split SparqlTemplate of the query template"""
+        ret = self._templates.get(template)
+        if ret is None:
+            ret = SparqlTemplate(template)
+            self._templates[template] = ret
+            while len(self._templates) > TEMPLATE_CACHE_SIZE:
+                self._templates.popitem(last=False)
+        else:
+            self._templates.move_to_end(template)
         return ret
 
+    @log
+    def _run_query(self, query, callback=None, cache_class=None, params=None,
+                   cancellable=None, progress=None):
+        """Run a SPARQL query and collect all rows of the result
+
+        Args:
+            query (str): SPARQL query. If params are given, the query is a
+                         template with ~name placeholders for them, which
+                         is split once.
+            callback (Optional[callable]): if set, the query and the cursor
+                                           iteration run asynchronously and
+                                           callback is invoked with the list
+                                           of rows from the main loop.
+            cache_class (Optional[str]): class of the resources the query
+                                         reads. Results of such queries are
+                                         cached until that class changes.
+            params (Optional[dict]): values of the query parameters.
+            cancellable (Optional[Gio.Cancellable]): cancels an asynchronous
+                                                     query, callback is not
+                                                     called then.
+            progress (Optional[callable]): receives the rows of an
+                                           asynchronous query in chunks of
+                                           STREAM_CHUNK_SIZE while they are
+                                           read.
+
+        Returns:
+            list of rows for synchronous calls, None otherwise
+        """
+        if params is not None:
+            query = self._template(query).format(params)
+
+        if cache_class:
+            ret = self.query_cache.lookup(query)
+            if ret is not None:
+                return self._reply(ret, callback, cancellable)
+            generation = self.query_cache.generation(cache_class)
+
+        def store(ret):
+            if cache_class:
+                self.query_cache.store(query, ret, cache_class, generation)
+
+        logger.debug(query)
+        if callback is None:
+            results = self.sparql.query(query)
+            ret = []
+            while (results.next(None)):
+                ret.append(self.parse_sparql(results))
+            self._remember_urls(ret)
+            store(ret)
+            return ret
+
+        def on_results(ret):
+            store(ret)
+            callback(ret)
+
+        request = QueryRequest(on_results, cancellable, progress)
+        self.sparql.query_async(query, cancellable, self._on_query_ready, request)
+
+    @log
+    def _run_update(self, template, params):
+        """Run a SPARQL update with ~name placeholders for the params"""
+        query = self._template(template).format(params)
+        logger.debug(query)
+        self.sparql.update(query, GLib.PRIORITY_DEFAULT, None)
+
+    def _on_query_ready(self, source, result, request):
+        try:
+            cursor = source.query_finish(result)
+        except GLib.Error as e:
+            if not request.cancelled(e):
+                logger.error("Could not run query: %s", e)
+                request.callback([])
+            return
+        cursor.next_async(request.cancellable, self._on_cursor_next, request)
+
+    def _on_cursor_next(self, cursor, result, request):
+        try:
+            has_next = cursor.next_finish(result)
+        except GLib.Error as e:
+            if request.cancelled(e):
+                cursor.close()
+                return
+            logger.error("Could not fetch query results: %s", e)
+            has_next = False
+
+        ret = request.rows
+        if has_next:
+            ret.append(self.parse_sparql(cursor))
+            if request.progress and len(ret) % STREAM_CHUNK_SIZE == 0:
+                request.progress(ret[-STREAM_CHUNK_SIZE:])
+            cursor.next_async(request.cancellable, self._on_cursor_next, request)
+        else:
+            cursor.close()
+            self._remember_urls(ret)
+            request.callback(ret)
+
+    def _remember_urls(self, rows):
+        for row in rows:
+            if 'id' in row and 'url' in row:
+                self._urls[row['id']] = row['url']
+
+    @log
+    def _resolve_posts(self, ids, callback):
+        """Fetch posts by their Tracker IDs
+
+        Args:
+            ids (iterable): Tracker IDs of the posts.
+            callback (callable): receives the list of posts still in the store.
+        """
+        query = """
+        SELECT %s""" % POST_SUMMARY_COLUMNS
+        query += """
+          BOUND(?tag) AS starred
+          { ?msg a mfo:FeedMessage;
+                 nco:creator ?creator
+            OPTIONAL { ?msg nao:hasTag ?tag
+                       FILTER (?tag = nao:predefined-tag-favorite) }
+            FILTER (tracker:id(?msg) IN (%s))
+          }
+        """ % ', '.join(str(i) for i in ids)
+
+        self._run_query(query, callback)
+
+    @log
+    def _resolve_channels(self, ids, callback):
+        """Fetch channels by their Tracker IDs
+
+        Args:
+            ids (iterable): Tracker IDs of the channels.
+            callback (callable): receives the list of channels still in the store.
+        """
+        query = """
+        SELECT
+          tracker:id(?chan) AS id
+          nie:url(?chan) AS url
+          nie:title(?chan) AS title
+          { ?chan a mfo:FeedChannel
+            FILTER (tracker:id(?chan) IN (%s))
+          }
+        """ % ', '.join(str(i) for i in ids)
+
+        self._run_query(query, callback)
+
     @log
     def on_graph_updated(self, connection, sender_name, object_path,
                          interface_name, signal_name, parameters, user_data=None):
-        unpacked = parameters.unpack()
-        #FIXME: handle deletes -- unpacked[1]
-        GLib.idle_add(self._handle_insert_event, unpacked[2])
+        class_name, deletes, inserts = parameters.unpack()
+        self.batcher.add(class_name,
+                         [EventItem(item) for item in deletes],
+                         [EventItem(item) for item in inserts])
 
     @log
-    def _handle_insert_event(self, items):
-        self.emit('items-updated')
-        self.emit('feeds-updated')
+    def _handle_events(self, class_name, deletes, inserts):
+        """Translate a GraphUpdated batch into per-resource signals
+
+        Args:
+            class_name (str): class of the changed resources.
+            deletes (list): EventItems of deleted triples.
+            inserts (list): EventItems of inserted triples.
+        """
+        known = set(self._urls)
+        deleted_ids = set(item.subject_id for item in deletes)
+        changed_ids = deleted_ids | set(item.subject_id for item in inserts)
+        if not changed_ids:
+            return
+
+        self.query_cache.invalidate(class_name)
+
+        if class_name == FEED_CHANNEL_CLASS:
+            resolve, prefix = self._resolve_channels, 'channel'
+        else:
+            resolve, prefix = self._resolve_posts, 'post'
+
+        def on_resolved(resources):
+            still_present = set()
+            for resource in resources:
+                still_present.add(resource['id'])
+                self._content_cache.pop(resource['url'], None)
+                if resource['id'] in known:
+                    self.emit(prefix + '-changed', resource)
+                else:
+                    self.emit(prefix + '-added', resource)
+
+            for removed_id in (deleted_ids & known) - still_present:
+                url = self._urls.pop(removed_id)
+                self._content_cache.pop(url, None)
+                self.emit(prefix + '-removed', url)
+
+            # The index also has posts never shown, so it gets all deletions
+            if prefix == 'post' and self.search_index:
+                self.search_index.remove_posts(deleted_ids - still_present)
+
+        resolve(changed_ids, on_resolved)
 
     @staticmethod
     @log
@@ -285,6 +982,10 @@ class Tracker(GObject.GObject):
                 value = GLib.DateTime.new_from_timeval_local(tv[1])
             elif t == Trackr.SparqlValueType.BOOLEAN:
                 value = sparql_ret.get_boolean(column)
+            elif t == Trackr.SparqlValueType.INTEGER:
+                value = sparql_ret.get_integer(column)
+            elif t == Trackr.SparqlValueType.UNBOUND:
+                value = None
             else:
                 try:
                     value = sparql_ret.get_string(column)[0]
@@ -305,3 +1006,222 @@ class EventItem:
         self.subject_id = items[1]
         self.pred_id = items[2]
         self.object_id = items[3]
+
+    @property
+    def key(self):
+        return (self.graph_id, self.subject_id, self.pred_id, self.object_id)
+
+
+class QueryRequest:
+    """State of an asynchronous query while its cursor is read"""
+
+    def __init__(self, callback, cancellable=None, progress=None):
+        self.callback = callback
+        self.cancellable = cancellable
+        self.progress = progress
+        self.rows = []
+
+    @staticmethod
+    def cancelled(error):
+        return error.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED)
+
+
+class SparqlTemplate:
+    """SPARQL query or update with ~name parameters
+
+    The template is split into its literal parts once, and values are
+    escaped into it on every use. Tracker 1.0 has no prepared statements, so
+    it still parses the query text every time.
+    """
+
+    PARAMETER = re.compile(r'~(\w+)')
+
+    def __init__(self, template):
+        self.template = template
+        # Literal parts alternating with parameter names
+        self._parts = self.PARAMETER.split(template)
+
+    @staticmethod
+    def literal(value):
+        """Format a Python value as SPARQL literal"""
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, int):
+            return str(value)
+        if isinstance(value, GLib.DateTime):
+            return '"%s"^^xsd:dateTime' % value.to_utc().format('%Y-%m-%dT%H:%M:%SZ')
+        return '"%s"' % Trackr.sparql_escape_string(value)
+
+    def format(self, params):
+        """Get the query text with the values filled in"""
+        parts = list(self._parts)
+        for i in range(1, len(parts), 2):
+            parts[i] = self.literal(params[parts[i]])
+        return ''.join(parts)
+
+
+class QueryCache:
+    """LRU cache of query results with expiry
+
+    Entries are keyed by the normalized query text, which includes all of its
+    parameters, and tagged with the class of the resources they were read
+    from so that a change to that class drops exactly the affected entries.
+    """
+
+    def __init__(self, size=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        """
+        Args:
+            size (int): maximum number of cached results.
+            ttl (int): lifetime of a cached result in seconds.
+        """
+        self.size = size
+        self.ttl = ttl
+
+        # key -> (expiry time, class name, rows)
+        self._entries = OrderedDict()
+        # Bumped on every invalidation of a class, so that results of queries
+        # started before a change are not stored
+        self._generations = {}
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(query):
+        return ' '.join(query.split())
+
+    def generation(self, class_name):
+        return self._generations.get(class_name, 0)
+
+    @log
+    def lookup(self, query):
+        """Get the cached result of the query
+
+        Returns:
+            a copy of the cached rows or None if the result is not cached
+        """
+        key = self._key(query)
+        entry = self._entries.get(key)
+        if entry and entry[0] < GLib.get_monotonic_time():
+            del self._entries[key]
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return [dict(row) for row in entry[2]]
+
+    @log
+    def store(self, query, rows, class_name, generation):
+        """Cache the result of the query
+
+        Args:
+            query (str): SPARQL query.
+            rows (list): result of the query.
+            class_name (str): class of the resources the query reads.
+            generation (int): generation of the class when the query started.
+        """
+        if generation != self.generation(class_name):
+            return
+
+        expiry = GLib.get_monotonic_time() + self.ttl * GLib.USEC_PER_SEC
+        self._entries[self._key(query)] = (expiry, class_name, [dict(row) for row in rows])
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    @log
+    def invalidate(self, class_name):
+        """Drop all results read from resources of the class"""
+        self._generations[class_name] = self.generation(class_name) + 1
+        for key in [key for key, entry in self._entries.items() if entry[1] == class_name]:
+            del self._entries[key]
+        logger.debug("Query cache: %d hits, %d misses", self.hits, self.misses)
+
+
+class EventBatcher:
+    """Coalesces bursts of change events into a single delivery
+
+    Events are accumulated per class until no new event arrived for `window`
+    ms or the oldest pending event is `max_latency` ms old, then `callback`
+    is called once per class with the merged deletes and inserts.
+    """
+
+    def __init__(self, callback, window=BATCH_WINDOW, max_latency=BATCH_MAX_LATENCY):
+        """
+        Args:
+            callback (callable): called as callback(class_name, deletes, inserts).
+            window (int): debounce period in ms.
+            max_latency (int): maximum delay of an event in ms.
+        """
+        self.callback = callback
+        self.window = window
+        self.max_latency = max_latency
+
+        # class name -> (deletes, inserts), both keyed by triple
+        self._pending = {}
+        self._first_event_time = None
+        self._timeout_id = None
+        self._folded = 0
+
+        # Statistics
+        self.raw_events = 0
+        self.deliveries = 0
+        self.last_folded = 0
+
+    @log
+    def add(self, class_name, deletes, inserts):
+        """Queue a change event
+
+        Args:
+            class_name (str): class of the changed resources.
+            deletes (list): EventItems of deleted triples.
+            inserts (list): EventItems of inserted triples.
+        """
+        pending_deletes, pending_inserts = self._pending.setdefault(class_name, ({}, {}))
+        for item in deletes:
+            pending_deletes[item.key] = item
+        for item in inserts:
+            pending_inserts[item.key] = item
+
+        self.raw_events += 1
+        self._folded += 1
+
+        now = GLib.get_monotonic_time()
+        if self._first_event_time is None:
+            self._first_event_time = now
+
+        if self._timeout_id:
+            GLib.source_remove(self._timeout_id)
+
+        elapsed = (now - self._first_event_time) // 1000
+        delay = max(0, min(self.window, self.max_latency - elapsed))
+        self._timeout_id = GLib.timeout_add(delay, self._on_timeout)
+
+    def _on_timeout(self):
+        self._timeout_id = None
+        return self.flush()
+
+    @log
+    def flush(self):
+        """Deliver all pending events right away"""
+        if self._timeout_id:
+            GLib.source_remove(self._timeout_id)
+            self._timeout_id = None
+
+        pending, self._pending = self._pending, {}
+        self.last_folded, self._folded = self._folded, 0
+        self._first_event_time = None
+        if not pending:
+            return False
+
+        self.deliveries += 1
+        logger.debug("Delivering change batch: %d raw events folded, %d batches delivered so far",
+                     self.last_folded, self.deliveries)
+
+        for class_name, (deletes, inserts) in pending.items():
+            self.callback(class_name, list(deletes.values()), list(inserts.values()))
+        return False
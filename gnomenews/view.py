@@ -13,20 +13,128 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from gi.repository import Gtk, GObject, WebKit2, GLib
+from gi.repository import Gtk, GObject, Gio, WebKit2, GLib
 
 from gettext import gettext as _
 
 from gnomenews import log
-from gnomenews.post import Post
+from gnomenews.post import Post, THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT
 import logging
 logger = logging.getLogger(__name__)
 
+# Number of posts fetched at once
+PAGE_SIZE = 10
+# Distance in pixels from the end of the list at which the next page is loaded
+SCROLL_THRESHOLD = 300
+# Tiles this far in pixels outside of the viewport already get their
+# thumbnails, tiles further away release them
+PRELOAD_MARGIN = 512
+RELEASE_MARGIN = 2048
+# Number of feed pages before and after the shown one whose posts are loaded
+FEED_PREFETCH = 1
+# Posts of feed pages not shown for this many seconds are dropped
+FEED_EVICTION_TIMEOUT = 300
+# Number of search results shown
+SEARCH_LIMIT = 100
+# Fields of a post which are shown on its tile, besides the date
+SUMMARY_FIELDS = ('title', 'fullname', 'snippet', 'is_read', 'channel')
+
+
+class PostPager:
+    """Keyset pagination state of a flowbox"""
+
+    def __init__(self, flowbox, fetch):
+        """
+        Args:
+            flowbox (Gtk.FlowBox): flowbox the posts are added to.
+            fetch (callable): called as fetch(after, callback) to query
+                              the page following the `after` key.
+        """
+        self.flowbox = flowbox
+        self.fetch = fetch
+        self.last_key = None
+        self.loading = False
+        self.exhausted = False
+        # Number of posts the loaded pages hold, live inserts past it are
+        # dropped from the end
+        self.size = 0
+
+
+class PostTile(Gtk.Image):
+    """Tile of a post in a flowbox
+
+    Tiles are created with the size of a thumbnail but without an image;
+    the thumbnail is only loaded while the tile is close to the viewport.
+    """
+
+    def __init__(self, post):
+        Gtk.Image.__init__(self)
+        self.set_size_request(THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT)
+        self.get_style_context().add_class('feed-box')
+
+        #Store the post object to refer to it later on
+        self.post = post.cursor
+        self.post_object = post
+        self.thumbnail_shown = False
+        post.connect('info-updated', self._on_thumbnail_ready)
+
+    @log
+    def show_thumbnail(self, priority=GLib.PRIORITY_DEFAULT):
+        if self.thumbnail_shown:
+            return
+        self.thumbnail_shown = True
+        if self.post_object.thumbnail:
+            self.set_from_file(self.post_object.thumbnail)
+        else:
+            self.post_object.load_thumbnail(priority)
+
+    @log
+    def release_thumbnail(self):
+        if not self.thumbnail_shown:
+            return
+        self.thumbnail_shown = False
+        self.post_object.cancel()
+        self.clear()
+
+    def _on_thumbnail_ready(self, post, data=None):
+        if self.thumbnail_shown:
+            self.set_from_file(post.thumbnail)
+
+
+class LazyView(Gtk.Box):
+    """Stack page which constructs its view when it is first shown
+
+    The stack switcher only needs the title, so views which are not visible
+    at startup cost nothing until they are opened.
+    """
+
+    def __init__(self, create, name, title=None):
+        """
+        Args:
+            create (callable): returns the view.
+            name (str): name of the page in the stack.
+            title (Optional[str]): title of the page in the stack switcher.
+        """
+        Gtk.Box.__init__(self, visible=True)
+        self.name = name
+        self.title = title
+        self._create = create
+        self.view = None
+
+    @log
+    def get_view(self):
+        """Get the view, constructing it on the first call"""
+        if self.view is None:
+            self.view = self._create()
+            self.pack_start(self.view, True, True, 0)
+        return self.view
+
 
 class GenericFeedsView(Gtk.Stack):
 
     __gsignals__ = {
         'open-article': (GObject.SignalFlags.RUN_FIRST, None, (str, str, str, str)),
+        'page-loaded': (GObject.SignalFlags.RUN_LAST, None, (int,)),
     }
 
     @log
@@ -38,15 +146,11 @@ class GenericFeedsView(Gtk.Stack):
 
         scrolledWindow = Gtk.ScrolledWindow()
         self.add(scrolledWindow)
+        self._vadjustment = scrolledWindow.get_vadjustment()
+        self._vadjustment.connect('value-changed', self._on_scroll_changed)
+        self._vadjustment.connect('changed', self._on_scroll_changed)
 
-        self.flowbox = Gtk.FlowBox(
-            min_children_per_line=2,
-            activate_on_single_click=True,
-            row_spacing=10, column_spacing=10,
-            margin=15,
-            selection_mode=Gtk.SelectionMode.NONE)
-        self.flowbox.get_style_context().add_class('feeds-list')
-        self.flowbox.connect('child-activated', self._post_activated)
+        self.flowbox = self._create_flowbox()
 
         self.feed_stack = Gtk.Stack(
             transition_type=Gtk.StackTransitionType.CROSSFADE,
@@ -72,30 +176,20 @@ class GenericFeedsView(Gtk.Stack):
         scrolledWindow.add(self._box)
 
         self.tracker = tracker
+        # Tiles currently holding their thumbnail
+        self._shown_tiles = set()
+        self._viewport_update_id = None
+        self.connect('map', self._on_map_changed)
+        self.connect('unmap', self._on_map_changed)
         self.show_all()
 
     @log
-    def _add_a_new_preview(self, cursor, child=None):
-        p = Post(cursor)
-        if child:
-            p.flowbox = child
-        else:
-            p.flowbox = self.flowbox
-        p.connect('info-updated', self._insert_post)
+    def _create_flowbox(self):
+        """Create a flowbox backed by a list of Post objects
 
-    @log
-    def _insert_post(self, source, post):
-        image = Gtk.Image.new_from_file(post.thumbnail)
-        image.get_style_context().add_class('feed-box')
-        image.show_all()
-
-        #Store the post object to refer to it later on
-        image.post = post.cursor
-
-        source.flowbox.insert(image, -1)
-
-    @log
-    def _add_new_feed(self, feed):
+        The posts are kept in flowbox.store sorted newest first, and are
+        also reachable by URL through flowbox.posts.
+        """
         flowbox = Gtk.FlowBox(
             min_children_per_line=2,
             activate_on_single_click=True,
@@ -104,47 +198,340 @@ class GenericFeedsView(Gtk.Stack):
             selection_mode=Gtk.SelectionMode.NONE)
         flowbox.get_style_context().add_class('feeds-list')
         flowbox.connect('child-activated', self._post_activated)
+        flowbox.store = Gio.ListStore(item_type=Post)
+        flowbox.posts = {}
+        flowbox.bind_model(flowbox.store, self._create_tile)
+        return flowbox
+
+    @staticmethod
+    def _create_tile(post, user_data=None):
+        tile = PostTile(post)
+        tile.show()
+        return tile
+
+    @staticmethod
+    def _post_key(post):
+        date = post.cursor['date']
+        return (date.to_unix() if date else 0, post.cursor['url'])
+
+    @staticmethod
+    def _compare_posts(post1, post2, user_data=None):
+        # Newest posts first, same order as the Tracker listings
+        key1 = GenericFeedsView._post_key(post1)
+        key2 = GenericFeedsView._post_key(post2)
+        return (key1 < key2) - (key1 > key2)
+
+    @log
+    def _add_a_new_preview(self, cursor, child=None):
+        flowbox = child or self.flowbox
+        p = Post(cursor)
+        flowbox.posts[cursor['url']] = p
+        flowbox.store.insert_sorted(p, self._compare_posts, None)
+        self._queue_viewport_update()
+
+    @staticmethod
+    def _same_summary(post1, post2):
+        """Whether the tiles of both posts look the same"""
+        date1 = post1['date'].to_unix() if post1['date'] else None
+        date2 = post2['date'].to_unix() if post2['date'] else None
+        return date1 == date2 and \
+            all(post1.get(field) == post2.get(field) for field in SUMMARY_FIELDS)
+
+    @log
+    def _replace_posts(self, flowbox, posts):
+        """Show the posts instead of the ones in the flowbox
+
+        Tiles of unchanged posts are kept along with their thumbnails, so
+        only what changed is drawn again.
+        """
+        new_posts = {post['url']: post for post in posts}
+        for i in reversed(range(flowbox.store.get_n_items())):
+            old = flowbox.store.get_item(i)
+            new = new_posts.get(old.cursor['url'])
+            if new is None or not self._same_summary(old.cursor, new):
+                old.cancel()
+                del flowbox.posts[old.cursor['url']]
+                flowbox.store.remove(i)
+
+        [self._add_a_new_preview(post, flowbox)
+         for post in posts if post['url'] not in flowbox.posts]
+        self._queue_viewport_update()
+
+    @log
+    def _clear_flowbox(self, flowbox):
+        for post in flowbox.posts.values():
+            post.cancel()
+        flowbox.posts.clear()
+        flowbox.store.remove_all()
+
+    @log
+    def _flowboxes(self):
+        return [self.flowbox]
+
+    @log
+    def _flowbox_for_post(self, post):
+        return self.flowbox
+
+    @log
+    def _visible_flowbox(self):
+        return self.flowbox
+
+    @log
+    def _accepts_post(self, post):
+        """Whether the post belongs to this view"""
+        return False
+
+    @log
+    def _find_post(self, url):
+        for flowbox in self._flowboxes():
+            if url in flowbox.posts:
+                return flowbox, flowbox.posts[url]
+        return None, None
+
+    @log
+    def _remove_post(self, url):
+        flowbox, post = self._find_post(url)
+        if not post:
+            return
+
+        post.cancel()
+        del flowbox.posts[url]
+        for i in range(flowbox.store.get_n_items()):
+            if flowbox.store.get_item(i) is post:
+                flowbox.store.remove(i)
+                break
+        self._queue_viewport_update()
+
+    @log
+    def on_post_added(self, tracker, post):
+        if not self._accepts_post(post):
+            return
+        if self._find_post(post['url'])[1]:
+            return
+
+        flowbox = self._flowbox_for_post(post)
+        if not flowbox:
+            return
+
+        # Posts beyond the loaded pages will show up when scrolling down
+        pager = getattr(flowbox, 'pager', None)
+        if pager and not pager.exhausted and pager.last_key and post['date'] and \
+           post['date'].to_unix() < pager.last_key[0].to_unix():
+            return
+
+        self._add_a_new_preview(post, flowbox)
+        if pager:
+            self._trim_pages(pager)
+
+    @log
+    def _trim_pages(self, pager):
+        """Drop the oldest posts the loaded pages don't have room for
+
+        They are loaded again when scrolling down, so a view left open
+        doesn't grow with every post added.
+        """
+        # The page being loaded follows the current last post
+        if pager.loading:
+            return
+        store = pager.flowbox.store
+        while store.get_n_items() > max(pager.size, PAGE_SIZE):
+            last = store.get_item(store.get_n_items() - 1)
+            previous = store.get_item(store.get_n_items() - 2).cursor
+            # The page key can't point past a post without date
+            if previous['date'] is None:
+                break
+            last.cancel()
+            del pager.flowbox.posts[last.cursor['url']]
+            store.remove(store.get_n_items() - 1)
+            pager.last_key = (previous['date'], previous['url'])
+            pager.exhausted = False
+        self._queue_viewport_update()
+
+    @log
+    def on_post_changed(self, tracker, post):
+        # The post may have moved and its thumbnail may be outdated
+        self._remove_post(post['url'])
+        self.on_post_added(tracker, post)
+
+    @log
+    def on_post_removed(self, tracker, url):
+        self._remove_post(url)
+
+    @log
+    def _add_new_feed(self, feed):
+        flowbox = self._create_flowbox()
         flowbox.show()
-        posts = self.tracker.get_posts_for_channel(feed['url'], 10)
-        [self._add_a_new_preview(post, flowbox) for post in posts]
 
         if not feed['title']:
             feed['title'] = _("Unknown feed")
+
+        # Posts are only loaded once the page is shown or about to be shown.
+        # Set before adding, the first page added is shown right away.
+        flowbox.url = feed['url']
+        flowbox.pager = None
+        flowbox.last_viewed = 0
         self.feed_stack.add_titled(flowbox, feed['url'], feed['title'])
 
     @log
     def _post_activated(self, box, child, user_data=None):
+        # Tiles of a snapshot are shown before the store is ready
+        if not self.tracker:
+            return
         post = child.get_children()[0].post
-        self.emit('open-article',
-                  post['title'], post['fullname'], post['url'], post["content"])
+        self.tracker.get_post_content(
+            post['url'],
+            callback=lambda content: self.emit('open-article',
+                                               post['title'], post['fullname'],
+                                               post['url'], content or ''))
 
     @log
-    def update_new_items(self, _=None):
-        [self.flowbox.remove(old_feed) for old_feed in self.flowbox.get_children()]
+    def _request_posts(self, **kwargs):
+        self.flowbox.pager = PostPager(
+            self.flowbox,
+            lambda after, callback: self.tracker.get_post_sorted_by_date(
+                PAGE_SIZE, after=after, callback=callback, **kwargs))
+        self._load_page(self.flowbox.pager, replace=True)
 
-        posts = self.tracker.get_post_sorted_by_date(10, unread=True)
-        [self._add_a_new_preview(post) for post in posts]
-        self.show_all()
+    @log
+    def _load_page(self, pager, replace=False):
+        pager.loading = True
+        pager.fetch(pager.last_key,
+                    lambda posts: self._on_page_loaded(pager, posts, replace))
 
     @log
-    def update_read_items(self):
-        [self.flowbox.remove(old_feed) for old_feed in self.flowbox.get_children()]
+    def _on_page_loaded(self, pager, posts, replace):
+        pager.loading = False
+        # The listing was refreshed while this page was being fetched
+        if getattr(pager.flowbox, 'pager', None) is not pager:
+            return
+
+        pager.exhausted = len(posts) < PAGE_SIZE
+        if posts:
+            last = posts[-1]
+            if last['date'] is None:
+                pager.exhausted = True
+            else:
+                pager.last_key = (last['date'], last['url'])
+
+        if replace:
+            self._replace_posts(pager.flowbox, posts)
+        else:
+            [self._add_a_new_preview(post, pager.flowbox)
+             for post in posts if post['url'] not in pager.flowbox.posts]
+        pager.size = pager.flowbox.store.get_n_items()
+        self.emit('page-loaded', len(posts))
 
-        posts = self.tracker.get_post_sorted_by_date(10, read_only=True)
-        [self._add_a_new_preview(post) for post in posts]
-        self.show_all()
+    @log
+    def _visible_pager(self):
+        return getattr(self._visible_flowbox(), 'pager', None)
+
+    def _on_scroll_changed(self, adjustment):
+        self._queue_viewport_update()
+
+        if adjustment.get_value() + adjustment.get_page_size() < \
+           adjustment.get_upper() - SCROLL_THRESHOLD:
+            return
+
+        pager = self._visible_pager()
+        if not pager or pager.loading or pager.exhausted:
+            return
+
+        self._load_page(pager)
+
+    def _on_map_changed(self, widget):
+        self._queue_viewport_update()
+
+    def _queue_viewport_update(self):
+        if not self._viewport_update_id:
+            self._viewport_update_id = GLib.idle_add(self._update_viewport)
+
+    def _tile_offset(self, flowbox, index):
+        """Get the vertical offset of a tile in the view and its child
+
+        The offset is None while the tile isn't laid out, e.g. right after
+        it was added.
+        """
+        child = flowbox.get_child_at_index(index)
+        if child is None:
+            return None, None
+        coordinates = child.translate_coordinates(self._box, 0, 0)
+        return (coordinates[1] if coordinates else None), child
 
     @log
-    def update_starred_items(self):
-        [self.flowbox.remove(old_feed) for old_feed in self.flowbox.get_children()]
+    def _update_viewport(self):
+        """Load thumbnails of tiles close to the viewport, release far ones
+
+        Tiles are laid out in model order, so the first tile close to the
+        viewport is found by bisection and only the tiles from there to the
+        end of the viewport are visited.
+        """
+        self._viewport_update_id = None
+
+        shown = set()
+        top = bottom = 0
+        flowbox = self._visible_flowbox()
+        if flowbox and flowbox.get_mapped() and flowbox.store.get_n_items():
+            top = self._vadjustment.get_value()
+            bottom = top + self._vadjustment.get_page_size()
+
+            low, high = 0, flowbox.store.get_n_items()
+            while low < high:
+                middle = (low + high) // 2
+                y, child = self._tile_offset(flowbox, middle)
+                # Tiles not laid out yet are searched through below
+                if y is not None and y + child.get_allocated_height() < top - PRELOAD_MARGIN:
+                    low = middle + 1
+                else:
+                    high = middle
+
+            for index in range(low, flowbox.store.get_n_items()):
+                y, child = self._tile_offset(flowbox, index)
+                if y is None:
+                    # Treated as outside the viewport until laid out
+                    continue
+                if y > bottom + PRELOAD_MARGIN:
+                    break
+                tile = child.get_children()[0]
+                # Tiles on screen are rendered before the preloaded ones
+                if y + child.get_allocated_height() >= top and y <= bottom:
+                    tile.show_thumbnail(GLib.PRIORITY_DEFAULT)
+                else:
+                    tile.show_thumbnail(GLib.PRIORITY_LOW)
+                shown.add(tile)
+
+            top -= RELEASE_MARGIN
+            bottom += RELEASE_MARGIN
+
+        for tile in self._shown_tiles - shown:
+            parent = tile.get_parent()
+            if parent and parent.get_parent() is flowbox and parent.get_mapped():
+                coordinates = parent.translate_coordinates(self._box, 0, 0)
+                if coordinates and top <= coordinates[1] <= bottom:
+                    shown.add(tile)
+                    continue
+            tile.release_thumbnail()
+
+        self._shown_tiles = shown
+        return False
 
-        posts = self.tracker.get_post_sorted_by_date(10, starred=True)
-        [self._add_a_new_preview(post) for post in posts]
-        self.show_all()
+    @log
+    def update_new_items(self, _=None):
+        self._request_posts(unread=True)
+
+    @log
+    def update_read_items(self):
+        self._request_posts(read_only=True)
+
+    @log
+    def update_starred_items(self):
+        self._request_posts(starred=True)
 
     @log
     def update_feeds(self, _=None):
-        feeds = self.tracker.get_channels()
+        self.tracker.get_channels(callback=self._add_new_feeds)
+
+    @log
+    def _add_new_feeds(self, feeds):
         for new_feed in feeds:
             if not self.feed_stack.get_child_by_name(new_feed['url']):
                 self._add_new_feed(new_feed)
@@ -200,15 +587,143 @@ class NewView(GenericFeedsView):
     def update(self):
         self.update_new_items()
 
+    @log
+    def _accepts_post(self, post):
+        return not post['is_read']
+
+    @log
+    def show_snapshot(self, posts):
+        """Show posts saved by a previous run until the store answers
+
+        Args:
+            posts (list): posts as returned by load_snapshot().
+        """
+        for cursor in posts:
+            thumbnail = cursor.pop('thumbnail', None)
+            content_hash = cursor.pop('content_hash', None)
+            self._add_a_new_preview(cursor)
+            post = self.flowbox.posts[cursor['url']]
+            if thumbnail:
+                post.thumbnail = thumbnail
+                post.content_hash = content_hash
+
+    @log
+    def get_snapshot(self):
+        """Get the first page of posts with their thumbnails for save_snapshot()"""
+        posts = []
+        for i in range(min(self.flowbox.store.get_n_items(), PAGE_SIZE)):
+            post = self.flowbox.store.get_item(i)
+            content_hash = getattr(post, 'content_hash', None) if post.thumbnail else None
+            posts.append(dict(post.cursor, content_hash=content_hash))
+        return posts
+
 
 class FeedsView(GenericFeedsView):
     def __init__(self, tracker):
         GenericFeedsView.__init__(self, tracker, 'feeds', _("Feeds"), show_feedlist=True)
+        self.feed_stack.connect('notify::visible-child', self._on_feed_changed)
+        GLib.timeout_add_seconds(FEED_EVICTION_TIMEOUT // 5, self._evict_feeds)
 
     @log
     def update(self):
         self.update_feeds()
 
+    @log
+    def _accepts_post(self, post):
+        return True
+
+    @log
+    def _flowboxes(self):
+        return self.feed_stack.get_children()
+
+    @log
+    def _visible_flowbox(self):
+        return self.feed_stack.get_visible_child()
+
+    @log
+    def _flowbox_for_post(self, post):
+        flowbox = self.feed_stack.get_child_by_name(post['channel'])
+        # Unloaded pages will get the post when they are loaded
+        if flowbox and flowbox.pager:
+            return flowbox
+        return None
+
+    @log
+    def _on_feed_changed(self, stack, property_name):
+        visible = self.feed_stack.get_visible_child()
+        if visible is None:
+            return
+
+        feeds = self.feed_stack.get_children()
+        index = feeds.index(visible)
+        now = GLib.get_monotonic_time()
+        neighbours = feeds[max(0, index - FEED_PREFETCH):index + FEED_PREFETCH + 1]
+        for flowbox in neighbours:
+            flowbox.last_viewed = now
+        self._load_feeds(neighbours)
+
+        self._queue_viewport_update()
+
+    @log
+    def _load_feeds(self, flowboxes):
+        """Load the first page of posts of the feed pages in one go"""
+        pagers = []
+        for flowbox in flowboxes:
+            if flowbox.pager:
+                continue
+
+            url = flowbox.url
+            flowbox.pager = PostPager(
+                flowbox,
+                lambda after, callback, url=url: self.tracker.get_posts_for_channel(
+                    url, PAGE_SIZE, after=after, callback=callback))
+            flowbox.pager.loading = True
+            pagers.append(flowbox.pager)
+
+        if pagers:
+            self.tracker.get_posts_for_channels(
+                [pager.flowbox.url for pager in pagers], PAGE_SIZE,
+                callback=lambda posts: [
+                    self._on_page_loaded(pager, posts[pager.flowbox.url], False)
+                    for pager in pagers])
+
+    @log
+    def _evict_feeds(self):
+        """Drop posts of feed pages which were not shown for a while"""
+        visible = self.feed_stack.get_visible_child()
+        expired = GLib.get_monotonic_time() - FEED_EVICTION_TIMEOUT * GLib.USEC_PER_SEC
+        for flowbox in self.feed_stack.get_children():
+            if flowbox.pager and flowbox is not visible and flowbox.last_viewed < expired:
+                self._clear_flowbox(flowbox)
+                flowbox.pager = None
+        return True
+
+    @log
+    def _add_new_feeds(self, feeds):
+        GenericFeedsView._add_new_feeds(self, feeds)
+        # The neighbours of the shown page only exist now
+        self._on_feed_changed(self.feed_stack, None)
+
+    @log
+    def on_channel_added(self, tracker, channel):
+        if not self.feed_stack.get_child_by_name(channel['url']):
+            self._add_new_feed(channel)
+            self._on_feed_changed(self.feed_stack, None)
+
+    @log
+    def on_channel_changed(self, tracker, channel):
+        flowbox = self.feed_stack.get_child_by_name(channel['url'])
+        if flowbox and channel['title']:
+            self.feed_stack.child_set_property(flowbox, 'title', channel['title'])
+
+    @log
+    def on_channel_removed(self, tracker, url):
+        flowbox = self.feed_stack.get_child_by_name(url)
+        if flowbox:
+            self._clear_flowbox(flowbox)
+            self.feed_stack.remove(flowbox)
+            self._queue_viewport_update()
+
 
 class StarredView(GenericFeedsView):
     def __init__(self, tracker):
@@ -218,6 +733,10 @@ class StarredView(GenericFeedsView):
     def update(self):
         self.update_starred_items()
 
+    @log
+    def _accepts_post(self, post):
+        return post['starred']
+
 
 class ReadView(GenericFeedsView):
     def __init__(self, tracker):
@@ -227,7 +746,141 @@ class ReadView(GenericFeedsView):
     def update(self):
         self.update_read_items()
 
+    @log
+    def _accepts_post(self, post):
+        return post['is_read']
+
 
 class SearchView(GenericFeedsView):
+    """Results of the search typed in the search bar, best matches first
+
+    A new search cancels the one still running. The results of the previous
+    search stay until the first results of the new one arrive, which are
+    then shown in chunks while they are read, keeping the tiles of posts
+    found again. When the text only extends the previous search and that
+    search returned all its matches, only those are searched again.
+    """
+
     def __init__(self, tracker):
         GenericFeedsView.__init__(self, tracker, 'search')
+        self.text = ''
+        self._cancellable = None
+        # Results of the running search read so far
+        self._results = []
+        # Text and post IDs of the last search which returned all matches
+        self._previous = None
+
+    @log
+    def search(self, text):
+        if self._cancellable:
+            self._cancellable.cancel()
+            self._cancellable = None
+        self.text = text
+        self._results = []
+        if not text.strip():
+            self._clear_flowbox(self.flowbox)
+            return
+
+        within = None
+        if self._previous and self._extends(text, self._previous[0]):
+            within = self._previous[1]
+
+        self._cancellable = cancellable = Gio.Cancellable()
+        self.tracker.get_text_matches(
+            text, SEARCH_LIMIT, cancellable=cancellable, within=within,
+            progress=lambda posts: self._on_results(cancellable, posts),
+            callback=lambda posts: self._on_search_finished(cancellable, text, posts))
+
+    @staticmethod
+    def _extends(text, previous):
+        """Whether all matches of text are also matches of previous
+
+        The last word is matched as prefix, earlier ones must be complete,
+        so the text may only go on with the last word or add words.
+        """
+        return text.startswith(previous) and previous.strip() != ''
+
+    @log
+    def _on_results(self, cancellable, posts):
+        if cancellable.is_cancelled():
+            return
+        self._results += posts
+        self._replace_posts(self.flowbox, self._results, complete=False)
+
+    @log
+    def _on_search_finished(self, cancellable, text, posts):
+        if cancellable.is_cancelled():
+            return
+        self._cancellable = None
+        self._results = []
+        self._replace_posts(self.flowbox, posts)
+        if len(posts) < SEARCH_LIMIT:
+            self._previous = (text, [post['id'] for post in posts])
+        else:
+            self._previous = None
+
+    @log
+    def _replace_posts(self, flowbox, posts, complete=True):
+        """Show the posts in the order of their ranking
+
+        Tiles of unchanged posts are kept along with their thumbnails and
+        only moved where needed.
+
+        Args:
+            flowbox (Gtk.FlowBox): the flowbox of the view.
+            posts (list): results, best matches first.
+            complete (Optional[bool]): whether these are all results. If
+                                       not, the tiles of other posts stay
+                                       behind them for now.
+        """
+        store = flowbox.store
+        new_posts = {post['url']: post for post in posts}
+        for i in reversed(range(store.get_n_items())):
+            old = store.get_item(i)
+            new = new_posts.get(old.cursor['url'])
+            if (new is None and complete) or \
+               (new is not None and not self._same_summary(old.cursor, new)):
+                old.cancel()
+                del flowbox.posts[old.cursor['url']]
+                store.remove(i)
+
+        for i, post in enumerate(posts):
+            if i < store.get_n_items() and store.get_item(i).cursor['url'] == post['url']:
+                continue
+            p = flowbox.posts.get(post['url'])
+            if p is None:
+                p = Post(post)
+                flowbox.posts[post['url']] = p
+            else:
+                for j in range(i + 1, store.get_n_items()):
+                    if store.get_item(j) is p:
+                        store.remove(j)
+                        break
+            store.insert(i, p)
+        self._queue_viewport_update()
+
+    @log
+    def on_post_changed(self, tracker, post):
+        flowbox, old = self._find_post(post['url'])
+        if not old:
+            return
+
+        old.cancel()
+        for i in range(flowbox.store.get_n_items()):
+            if flowbox.store.get_item(i) is old:
+                new = Post(post)
+                flowbox.posts[post['url']] = new
+                flowbox.store.splice(i, 1, [new])
+                break
+        self._queue_viewport_update()
+        # The post may match other searches now
+        self._previous = None
+
+    @log
+    def on_post_added(self, tracker, post):
+        # The remembered results can't include posts added since
+        self._previous = None
+
+    @log
+    def on_post_removed(self, tracker, url):
+        GenericFeedsView.on_post_removed(self, tracker, url)
@@ -16,9 +16,14 @@
 
 from gi.repository import Gtk, Gio, GLib
 from gettext import gettext as _
+from functools import partial
 
 from gnomenews.toolbar import Toolbar, ToolbarState
-from gnomenews.tracker import Tracker
+from gnomenews.backend import get_storage_backend_async
+from gnomenews.fetcher import Fetcher
+from gnomenews.scheduler import PollScheduler
+from gnomenews.snapshot import load_snapshot, save_snapshot
+from gnomenews import startup
 from gnomenews import view
 
 from gnomenews import log
@@ -27,6 +32,13 @@ logger = logging.getLogger(__name__)
 
 
 class Window(Gtk.ApplicationWindow):
+    """Main window
+
+    The window is drawn before the storage backend is ready, which is set
+    up asynchronously. Views are constructed when they are first shown.
+    Until the store answers, the New view shows the posts it showed when
+    the application was last closed.
+    """
 
     @log
     def __init__(self, app):
@@ -36,12 +48,49 @@ class Window(Gtk.ApplicationWindow):
         self.settings = Gio.Settings.new('org.gnome.News')
         self.set_size_request(200, 100)
         self.set_icon_name('gnome-news')
+        self.thumbnail_cache = app.thumbnail_cache
 
-        self.tracker = Tracker()
+        self.tracker = None
+        self.fetcher = None
+        self.scheduler = None
 
         self.restore_saved_size()
         # Start drawing UI
         self._setup_view()
+        self._draw_handler = self.connect_after('draw', self._on_first_draw)
+        startup.mark('window-constructed')
+
+        get_storage_backend_async(self._on_backend_ready)
+
+    def _on_first_draw(self, widget, cr):
+        self.disconnect(self._draw_handler)
+        startup.mark('first-frame')
+        return False
+
+    @log
+    def _on_backend_ready(self, backend):
+        startup.mark('backend-ready')
+        self.tracker = backend
+        self.tracker.connect('post-removed', self.thumbnail_cache.on_post_removed)
+        self.tracker.connect('channel-removed', self.thumbnail_cache.on_channel_removed)
+        if not self.tracker.fetches_feeds:
+            self.fetcher = Fetcher(self.tracker)
+            self.fetcher.start()
+        self.scheduler = PollScheduler(self.tracker)
+        self.scheduler.start()
+
+        # Views constructed before, e.g. for the snapshot
+        for i in self.views:
+            if i.view:
+                i.view.tracker = self.tracker
+                self._connect_view(i.view)
+
+        self.toolbar.add_toggle_button.set_sensitive(True)
+        for name in ('import-opml', 'export-opml'):
+            self.get_application().lookup_action(name).set_enabled(True)
+        self.view_changed(self._stack, None)
+        if self.search_bar.get_search_mode():
+            self._on_search_changed(self.search_entry)
 
     @log
     def restore_saved_size(self):
@@ -82,6 +131,16 @@ class Window(Gtk.ApplicationWindow):
     def _setup_view(self):
         self._box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
         self.views = []
+
+        self.search_entry = Gtk.SearchEntry(width_chars=40)
+        self.search_entry.connect('search-changed', self._on_search_changed)
+        self.search_bar = Gtk.SearchBar()
+        self.search_bar.add(self.search_entry)
+        self.search_bar.connect_entry(self.search_entry)
+        self.search_bar.connect('notify::search-mode-enabled', self._on_search_mode_changed)
+        self._box.pack_start(self.search_bar, False, False, 0)
+        self.connect('key-press-event', self._on_key_press)
+
         self.toolbar = Toolbar(self)
         self._stack = Gtk.Stack(
             transition_type=Gtk.StackTransitionType.CROSSFADE,
@@ -98,34 +157,99 @@ class Window(Gtk.ApplicationWindow):
 
         self.show_all()
         self.toolbar._back_button.set_visible(False)
+        # Channels can only be added once the store is there
+        self.toolbar.add_toggle_button.set_sensitive(False)
 
     @log
     def view_changed(self, stack, property_name):
         visible_view = self._stack.get_visible_child()
-        if visible_view in self.views:
-            visible_view.update()
+        if self.tracker and visible_view in self.views:
+            visible_view.get_view().update()
 
     @log
     def _add_views(self):
-        self.views.append(view.NewView(self.tracker))
-        self.views.append(view.FeedsView(self.tracker))
-        self.views.append(view.StarredView(self.tracker))
-        self.views.append(view.ReadView(self.tracker))
+        self.views.append(view.LazyView(partial(self._create_view, view.NewView), 'new', _("New")))
+        self.views.append(view.LazyView(partial(self._create_view, view.FeedsView),
+                                        'feeds', _("Feeds")))
+        self.views.append(view.LazyView(partial(self._create_view, view.StarredView),
+                                        'starred', _("Starred")))
+        self.views.append(view.LazyView(partial(self._create_view, view.ReadView),
+                                        'read', _("Read")))
+        self.search_view = view.LazyView(partial(self._create_view, view.SearchView), 'search')
+        self.views.append(self.search_view)
 
         for i in self.views:
             if i.title:
                 self._stack.add_titled(i, i.name, i.title)
             else:
                 self._stack.add_named(i, i.name)
-            i.connect('open-article', self.toolbar._update_title)
-
-        self.views.append(view.SearchView(self.tracker))
 
         self.toolbar.set_stack(self._stack)
         self._stack.set_visible_child(self.views[0])
 
-        self.tracker.connect('items-updated', self.views[0].update_new_items)
-        self.tracker.connect('feeds-updated', self.views[1].update_feeds)
+        posts = load_snapshot()
+        if posts:
+            self.views[0].get_view().show_snapshot(posts)
+            startup.mark('snapshot-shown')
+
+    @log
+    def _create_view(self, view_class):
+        new_view = view_class(self.tracker)
+        new_view.connect('open-article', self.toolbar._update_title)
+        if view_class is view.NewView:
+            new_view.connect('page-loaded', self._on_first_content)
+        if self.tracker:
+            self._connect_view(new_view)
+        return new_view
+
+    @log
+    def _connect_view(self, new_view):
+        self.tracker.connect('post-added', new_view.on_post_added)
+        self.tracker.connect('post-changed', new_view.on_post_changed)
+        self.tracker.connect('post-removed', new_view.on_post_removed)
+        if isinstance(new_view, view.FeedsView):
+            self.tracker.connect('channel-added', new_view.on_channel_added)
+            self.tracker.connect('channel-changed', new_view.on_channel_changed)
+            self.tracker.connect('channel-removed', new_view.on_channel_removed)
+
+    @log
+    def save_snapshot(self):
+        """Save the posts of the New view for the next start"""
+        new_view = self.views[0].view
+        # Without the store the view still shows the last snapshot
+        if new_view and self.tracker:
+            save_snapshot(new_view.get_snapshot())
+
+    def _on_first_content(self, new_view, count):
+        new_view.disconnect_by_func(self._on_first_content)
+        startup.mark('first-content')
+
+    def _on_key_press(self, widget, event):
+        # Typing anywhere but in the article starts a search
+        if self._stack.get_visible_child_name() == 'feedview':
+            return False
+        return self.search_bar.handle_event(event)
+
+    @log
+    def _on_search_mode_changed(self, search_bar, property_name):
+        if search_bar.get_search_mode():
+            if self._stack.get_visible_child() is not self.search_view:
+                self._stack.search_previous_view = self._stack.get_visible_child()
+            self._stack.set_visible_child(self.search_view)
+            self.toolbar.set_state(ToolbarState.SEARCH_VIEW)
+        else:
+            self.search_entry.set_text('')
+            if getattr(self._stack, 'search_previous_view', None):
+                self._stack.set_visible_child(self._stack.search_previous_view)
+                self._stack.search_previous_view = None
+            self.toolbar.set_state(ToolbarState.MAIN)
+
+    @log
+    def _on_search_changed(self, entry):
+        # GtkSearchEntry already holds the signal back while typing. Text
+        # typed before the store is ready is searched for once it is.
+        if self.tracker:
+            self.search_view.get_view().search(entry.get_text())
 
     @log
     def _open_article_view(self, url, contents):
@@ -140,6 +264,9 @@ class Window(Gtk.ApplicationWindow):
         self._stack.set_visible_child(self._stack.previous_view)
         self._stack.previous_view = None
         self._stack.remove(self.feed_view)
-        self.toolbar.set_state(ToolbarState.MAIN)
+        if self._stack.get_visible_child() is self.search_view:
+            self.toolbar.set_state(ToolbarState.SEARCH_VIEW)
+        else:
+            self.toolbar.set_state(ToolbarState.MAIN)
         self.feed_view.disconnect(self.tracker.post_read_signal)
         self.feed_view = None